@@ -0,0 +1,129 @@
+import hashlib
+import hmac
+import os
+import re
+import secrets
+import time
+from collections import OrderedDict
+
+# API keys are stored as HMAC-SHA256(API_KEY_SECRET, key) in users.api_key_hash
+# (unique index), plus a short display prefix. Changing the secret invalidates
+# every issued key.
+API_KEY_SECRET = os.getenv("API_KEY_SECRET", os.getenv("SECRET_KEY", "your-super-secret-key")).encode()
+API_KEY_PREFIX = "sk_live_"
+API_KEY_PATTERN = re.compile(r"^sk_live_[0-9a-f]{32}$")
+# Characters of the key kept in the clear for display ("sk_live_" + 6 hex)
+DISPLAY_PREFIX_LENGTH = len(API_KEY_PREFIX) + 6
+
+# Display prefixes of issued keys, held in memory so a key whose prefix was
+# never issued is refused without a query. Reloaded every ISSUED_PREFIX_TTL,
+# and on an unknown prefix at most once per ISSUED_PREFIX_RELOAD (a key made
+# by another API process becomes usable here within that delay).
+ISSUED_PREFIX_TTL = float(os.getenv("ISSUED_PREFIX_TTL", "300")) # seconds
+ISSUED_PREFIX_RELOAD = float(os.getenv("ISSUED_PREFIX_RELOAD", "5")) # seconds
+
+# Rejected keys remembered in memory so repeated bad keys skip Postgres
+INVALID_KEY_CACHE_SIZE = int(os.getenv("INVALID_KEY_CACHE_SIZE", "100000"))
+INVALID_KEY_CACHE_TTL = float(os.getenv("INVALID_KEY_CACHE_TTL", "300")) # seconds
+
+def generate_api_key():
+    return API_KEY_PREFIX + secrets.token_hex(16)
+
+def is_well_formed(api_key: str):
+    """Every issued key matches API_KEY_PATTERN; anything else is rejected without a lookup"""
+    return bool(api_key) and API_KEY_PATTERN.match(api_key) is not None
+
+def hash_api_key(api_key: str):
+    return hmac.new(API_KEY_SECRET, api_key.encode(), hashlib.sha256).hexdigest()
+
+def display_prefix(api_key: str):
+    return api_key[:DISPLAY_PREFIX_LENGTH]
+
+def mask(prefix: str = None):
+    """What /api/key and /api/me show for a stored key"""
+    return f"{prefix}…" if prefix else None
+
+class InvalidKeyCache:
+    """LRU of key hashes that matched no user, each remembered for a TTL"""
+
+    def __init__(self, size=INVALID_KEY_CACHE_SIZE, ttl=INVALID_KEY_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.counters = {"malformed": 0, "unknown_prefix": 0, "rejected": 0, "added": 0}
+
+    def __contains__(self, key_hash):
+        expires_at = self.entries.get(key_hash)
+        if expires_at is None:
+            return False
+        if expires_at < time.monotonic():
+            del self.entries[key_hash]
+            return False
+        self.entries.move_to_end(key_hash)
+        self.counters["rejected"] += 1
+        return True
+
+    def add(self, key_hash):
+        self.entries[key_hash] = time.monotonic() + self.ttl
+        self.entries.move_to_end(key_hash)
+        self.counters["added"] += 1
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def discard(self, key_hash):
+        self.entries.pop(key_hash, None)
+
+    def stats(self):
+        return {
+            "size": len(self.entries), "max_size": self.size, "ttl_seconds": self.ttl,
+            "issued_prefixes": len(issued_prefixes.prefixes), **self.counters,
+        }
+
+invalid_keys = InvalidKeyCache()
+
+class IssuedPrefixes:
+    """Set of users.api_key_prefix values; see ISSUED_PREFIX_TTL"""
+
+    def __init__(self, ttl=ISSUED_PREFIX_TTL, reload_after=ISSUED_PREFIX_RELOAD):
+        self.ttl = ttl
+        self.reload_after = reload_after
+        self.prefixes = set()
+        self.loaded_at = None
+
+    def needs_load(self, missed: bool = False):
+        """True when the set is expired, or when a lookup missed and the last load is old enough to retry"""
+        if self.loaded_at is None:
+            return True
+        age = time.monotonic() - self.loaded_at
+        return age > self.ttl or (missed and age > self.reload_after)
+
+    def mark_loading(self):
+        # Set before the query is awaited, so concurrent misses do not all reload
+        self.loaded_at = time.monotonic()
+
+    def replace(self, prefixes):
+        self.prefixes = set(prefixes)
+
+    def add(self, prefix: str):
+        self.prefixes.add(prefix)
+
+    def __contains__(self, prefix):
+        return prefix in self.prefixes
+
+issued_prefixes = IssuedPrefixes()
+
+def hash_stored_keys(conn):
+    """
+    Replace raw keys left in users.api_key by hash + prefix (psycopg2 `conn`).
+    Runs at API startup after the migrations; a no-op once nothing is left.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT email, api_key FROM users WHERE api_key IS NOT NULL AND api_key_hash IS NULL")
+    rows = cursor.fetchall()
+    for email, api_key in rows:
+        cursor.execute(
+            "UPDATE users SET api_key = NULL, api_key_hash = %s, api_key_prefix = %s WHERE email = %s",
+            (hash_api_key(api_key), display_prefix(api_key), email)
+        )
+    conn.commit()
+    return len(rows)
@@ -0,0 +1,216 @@
+import random
+import time
+import weakref
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+from database import (
+    DB_URL, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_HEALTHCHECK_INTERVAL, DB_POOL_MAX_IDLE, PICK_RANDOM_SAMPLE,
+    STREAM_CHUNK_SIZE, PROXY_LINE_COLUMNS,
+    USER_DEFICIT_SQL, ASSIGN_PROXIES_SQL, ADD_ASSIGNED_COUNT_SQL, RESET_ASSIGNED_COUNTS_SQL, STATS_SQL,
+    SAVE_HISTORY_SQL, GET_HISTORY_SQL, UPDATE_USER_LIMIT_SQL, USER_BY_EMAIL_SQL,
+    USER_BY_API_KEY_SQL, ISSUED_PREFIXES_SQL, UPDATE_API_KEY_SQL, CLEAR_PROXIES_SQL,
+    build_proxies_query, build_page, build_stream_query, build_pick_random_query, build_stats, choose_proxy, group_by_level,
+)
+from api_keys import display_prefix, hash_api_key, invalid_keys, is_well_formed, issued_prefixes
+from user_cache import user_cache
+
+class AsyncPostgresClient:
+    """
+    Non-blocking twin of PostgresClient for the FastAPI handlers.
+    Same method names and return shapes, backed by a psycopg 3 async pool so
+    a DB round trip yields to the event loop instead of stalling it.
+    """
+
+    def __init__(self, dsn: str = DB_URL):
+        # connection -> monotonic time it was returned, for _check_if_idle
+        self._returned_at = weakref.WeakKeyDictionary()
+        self.pool = AsyncConnectionPool(
+            dsn,
+            min_size=DB_POOL_MIN,
+            max_size=DB_POOL_MAX,
+            timeout=DB_POOL_TIMEOUT,
+            max_idle=DB_POOL_MAX_IDLE,
+            check=self._check_if_idle,
+            reset=self._mark_returned,
+            open=False,
+        )
+
+    async def _mark_returned(self, conn):
+        self._returned_at[conn] = time.monotonic()
+
+    async def _check_if_idle(self, conn):
+        """Ping on checkout only after DB_POOL_HEALTHCHECK_INTERVAL idle, like the sync pool"""
+        returned_at = self._returned_at.get(conn)
+        if returned_at is not None and time.monotonic() - returned_at >= DB_POOL_HEALTHCHECK_INTERVAL:
+            await AsyncConnectionPool.check_connection(conn)
+
+    async def open(self):
+        await self.pool.open()
+
+    async def close(self):
+        await self.pool.close()
+
+    async def _fetchall(self, query, params=()):
+        async with self.pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cursor:
+                await cursor.execute(query, params)
+                return await cursor.fetchall()
+
+    async def _fetchone(self, query, params=()):
+        async with self.pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cursor:
+                await cursor.execute(query, params)
+                return await cursor.fetchone()
+
+    async def _execute(self, query, params=()):
+        # pool.connection() commits on a clean exit
+        async with self.pool.connection() as conn:
+            await conn.execute(query, params)
+
+    async def top_up_user(self, email: str):
+        """Top up the user's assignment (see database.top_up). Returns the newly assigned rows."""
+        # One transaction: pool.connection() commits on a clean exit
+        async with self.pool.connection() as conn:
+            cursor = await conn.execute(USER_DEFICIT_SQL, (email,))
+            row = await cursor.fetchone()
+            if not row or row[0] <= 0:
+                return []
+            async with conn.cursor(row_factory=dict_row) as cursor:
+                await cursor.execute(ASSIGN_PROXIES_SQL, (email, row[0]))
+                assigned = await cursor.fetchall()
+            if assigned:
+                await conn.execute(ADD_ASSIGNED_COUNT_SQL, (len(assigned), email))
+            return assigned
+
+    async def get_proxies(self, level: str, limit: int = None, user_email: str = None, is_admin: bool = False, fields=None, after=None):
+        """One keyset page of `level`: {"items": [...], "next_cursor": ...}"""
+        query, params = build_proxies_query(level, limit, user_email, is_admin, fields, after)
+        rows = await self._fetchall(query, params)
+        return build_page(rows, limit, fields)
+
+    async def get_all_proxies(self, limit: int = None, user_email: str = None, is_admin: bool = False, fields=None, after=None):
+        query, params = build_proxies_query(None, limit, user_email, is_admin, fields, after)
+        rows = await self._fetchall(query, params)
+        return group_by_level(rows, fields, limit)
+
+    async def stream_rows(self, limit: int, user_email: str = None, is_admin: bool = False, columns: str = PROXY_LINE_COLUMNS):
+        """
+        Async generator of row-tuple lists, STREAM_CHUNK_SIZE per server-side
+        cursor fetch. Holds one pooled connection until exhausted.
+        """
+        query, params = build_stream_query(limit, user_email, is_admin, columns)
+        async with self.pool.connection() as conn:
+            async with conn.cursor(name="stream_rows") as cursor:
+                await cursor.execute(query, params)
+                while True:
+                    rows = await cursor.fetchmany(STREAM_CHUNK_SIZE)
+                    if not rows:
+                        break
+                    yield rows
+
+    async def stream_proxies(self, limit: int, user_email: str = None, is_admin: bool = False):
+        """Async generator of "ip:port\n" text, one chunk of lines per cursor fetch"""
+        async for rows in self.stream_rows(limit, user_email, is_admin):
+            yield "".join(f"{row[0]}\n" for row in rows)
+
+    async def pick_random(self, levels, user_email: str = None, is_admin: bool = False, weighted: bool = False):
+        """One random proxy from `levels` via index seeks on rand_key"""
+        pivot = random.random()
+        sample = PICK_RANDOM_SAMPLE if weighted else 1
+        async with self.pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cursor:
+                await cursor.execute(*build_pick_random_query(levels, pivot, sample, user_email, is_admin))
+                rows = await cursor.fetchall()
+                if len(rows) < sample:
+                    await cursor.execute(*build_pick_random_query(levels, pivot, sample - len(rows), user_email, is_admin, wrap=True))
+                    rows += await cursor.fetchall()
+
+        return choose_proxy(rows, weighted)
+
+    async def get_stats(self):
+        async with self.pool.connection() as conn:
+            cursor = await conn.execute(STATS_SQL)
+            return build_stats(await cursor.fetchall())
+
+    async def save_history(self, timestamp, gold, silver, bronze):
+        await self._execute(SAVE_HISTORY_SQL, (timestamp, gold, silver, bronze))
+
+    async def get_history(self, limit=20):
+        rows = await self._fetchall(GET_HISTORY_SQL, (limit,))
+        # Return in reverse order (oldest first) for the graph
+        return list(reversed(rows))
+
+    async def update_user_limit(self, email: str, new_limit: int):
+        await self._execute(UPDATE_USER_LIMIT_SQL, (new_limit, email))
+        user_cache.invalidate(email)
+
+    async def get_user_by_email(self, email: str):
+        """Served from user_cache when fresh; misses (unknown users) are not cached"""
+        user = user_cache.get_by_email(email)
+        if user is None:
+            user = await self._fetchone(USER_BY_EMAIL_SQL, (email,))
+            if user:
+                user_cache.put(user)
+        return user
+
+    async def load_issued_prefixes(self):
+        issued_prefixes.mark_loading()
+        try:
+            async with self.pool.connection() as conn:
+                cursor = await conn.execute(ISSUED_PREFIXES_SQL)
+                issued_prefixes.replace(row[0] for row in await cursor.fetchall())
+        except Exception:
+            issued_prefixes.loaded_at = None # retry on the next lookup
+            raise
+
+    async def get_user_by_api_key(self, api_key: str):
+        """
+        Malformed keys, keys whose prefix was never issued and keys rejected
+        recently (invalid_keys) are answered in memory; valid ones come from
+        user_cache or the api_key_hash index.
+        """
+        if not is_well_formed(api_key):
+            invalid_keys.counters["malformed"] += 1
+            return None
+        prefix = display_prefix(api_key)
+        if issued_prefixes.needs_load(missed=prefix not in issued_prefixes):
+            await self.load_issued_prefixes()
+        if prefix not in issued_prefixes:
+            invalid_keys.counters["unknown_prefix"] += 1
+            return None
+        key_hash = hash_api_key(api_key)
+        if key_hash in invalid_keys:
+            return None
+        user = user_cache.get_by_key_hash(key_hash)
+        if user is None:
+            user = await self._fetchone(USER_BY_API_KEY_SQL, (key_hash,))
+            if user:
+                user_cache.put(user, key_hash)
+            else:
+                invalid_keys.add(key_hash)
+        return user
+
+    async def update_api_key(self, email: str, new_key: str):
+        key_hash = hash_api_key(new_key)
+        await self._execute(UPDATE_API_KEY_SQL, (key_hash, display_prefix(new_key), email))
+        issued_prefixes.add(display_prefix(new_key))
+        invalid_keys.discard(key_hash)
+        # Also drops the old key's entry, so it stops authenticating here at once
+        user_cache.invalidate(email)
+
+    async def clear_proxies(self):
+        async with self.pool.connection() as conn:
+            await conn.execute(CLEAR_PROXIES_SQL)
+            await conn.execute(RESET_ASSIGNED_COUNTS_SQL)
+
+    def pool_stats(self):
+        return self.pool.get_stats()
+
+    def user_cache_stats(self):
+        return user_cache.stats()
+
+    def invalid_key_stats(self):
+        return invalid_keys.stats()
+
+# Shared instance used by the router and auth dependencies
+db = AsyncPostgresClient()
@@ -1,14 +1,13 @@
 from passlib.context import CryptContext
-from database import get_db_connection, PostgresClient
+from database import db_connection
+from async_database import db
+import asyncio
 import psycopg2
 import os
 from jose import jwt, JWTError
 from fastapi import Depends, HTTPException, status, Security
 from fastapi.security import OAuth2PasswordBearer, APIKeyHeader
 
-# Initialize PostgresClient for auth checks
-redis_client = PostgresClient() 
-
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 SECRET_KEY = os.getenv("SECRET_KEY", "your-super-secret-key") # IMPORTANT: Change this in production!
@@ -34,38 +33,30 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 def create_user(email, password, proxy_limit=15, is_admin=False):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        hashed_password = get_password_hash(password)
-        cursor.execute(
-            "INSERT INTO users (email, password_hash, proxy_limit, is_admin) VALUES (%s, %s, %s, %s)", 
-            (email, hashed_password, proxy_limit, is_admin)
-        )
-        conn.commit()
-        print(f"User '{email}' created successfully.")
-    except psycopg2.IntegrityError:
-        conn.rollback()
-        print(f"User '{email}' already exists.")
-    except Exception as e:
-        conn.rollback()
-        print(f"Error creating user: {e}")
-    finally:
-        conn.close()
-
-def authenticate_user(email, password):
-    conn = get_db_connection()
-    # Use RealDictCursor to access columns by name
-    from psycopg2.extras import RealDictCursor
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
-    user = cursor.fetchone()
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            hashed_password = get_password_hash(password)
+            cursor.execute(
+                "INSERT INTO users (email, password_hash, proxy_limit, is_admin) VALUES (%s, %s, %s, %s)", 
+                (email, hashed_password, proxy_limit, is_admin)
+            )
+            conn.commit()
+            print(f"User '{email}' created successfully.")
+        except psycopg2.IntegrityError:
+            conn.rollback()
+            print(f"User '{email}' already exists.")
+        except Exception as e:
+            conn.rollback()
+            print(f"Error creating user: {e}")
+
+async def authenticate_user(email, password):
+    user = await db.get_user_by_email(email)
     
     if not user:
         return False
-    if not verify_password(password, user["password_hash"]):
+    # bcrypt is deliberately slow, keep it off the event loop
+    if not await asyncio.to_thread(verify_password, password, user["password_hash"]):
         return False
     return user
 
@@ -83,7 +74,7 @@ credentials_exception = HTTPException(
     headers={"WWW-Authenticate": "Bearer"},
 )
 
-def get_current_user_obj(token: str = Depends(oauth2_scheme)):
+async def get_current_user_obj(token: str = Depends(oauth2_scheme)):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
@@ -92,7 +83,7 @@ def get_current_user_obj(token: str = Depends(oauth2_scheme)):
     except JWTError:
         raise credentials_exception
     
-    user = redis_client.get_user_by_email(email)
+    user = await db.get_user_by_email(email)
     if user is None:
         raise credentials_exception
         
@@ -104,7 +95,7 @@ async def get_api_key_user(
     if not api_key:
         return None
         
-    user = redis_client.get_user_by_api_key(api_key)
+    user = await db.get_user_by_api_key(api_key)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -118,7 +109,7 @@ async def get_dual_auth_user(
 ):
     # 1. Try API Key
     if api_key:
-        user = redis_client.get_user_by_api_key(api_key)
+        user = await db.get_user_by_api_key(api_key)
         if user:
             return user
     
@@ -128,7 +119,7 @@ async def get_dual_auth_user(
             payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
             email: str = payload.get("sub")
             if email:
-                user = redis_client.get_user_by_email(email)
+                user = await db.get_user_by_email(email)
                 if user:
                     return user
         except JWTError:
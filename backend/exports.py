@@ -0,0 +1,69 @@
+import asyncio
+import csv
+import io
+import json
+import os
+import tempfile
+
+import openpyxl
+
+from database import EXPORT_HEADERS
+
+# Exports are fed chunk by chunk from AsyncPostgresClient.stream_rows, so
+# memory is bounded by one chunk (plus the spool limit for xlsx).
+
+# xlsx output stays in memory up to this size, then spills to a temp file
+XLSX_SPOOL_BYTES = int(os.getenv("XLSX_SPOOL_BYTES", str(8 * 1024 * 1024)))
+FILE_CHUNK_BYTES = 64 * 1024
+
+NDJSON_KEYS = ["ip", "port", "country", "country_code", "latency", "level"]
+
+async def csv_chunks(row_chunks):
+    """CSV text, header first, one piece per row chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_HEADERS)
+    yield buffer.getvalue()
+    async for rows in row_chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+async def ndjson_chunks(row_chunks):
+    """One JSON object per line"""
+    async for rows in row_chunks:
+        yield "".join(json.dumps(dict(zip(NDJSON_KEYS, row))) + "\n" for row in rows)
+
+def append_rows(ws, rows):
+    for row in rows:
+        ws.append(list(row))
+
+async def build_xlsx(row_chunks):
+    """
+    Write-only workbook: openpyxl streams each appended row to its own temp
+    file instead of keeping cells. xlsx is a zip, so nothing can be sent
+    before save(); the result goes to a spooled file read back by iter_file.
+    Appends and the save run in a thread to keep the event loop free.
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Proxies")
+    ws.append(EXPORT_HEADERS)
+    async for rows in row_chunks:
+        await asyncio.to_thread(append_rows, ws, rows)
+
+    spool = tempfile.SpooledTemporaryFile(max_size=XLSX_SPOOL_BYTES)
+    await asyncio.to_thread(wb.save, spool)
+    spool.seek(0)
+    return spool
+
+def iter_file(f):
+    """Read a file in FILE_CHUNK_BYTES pieces and close it at the end (StreamingResponse runs this in a thread)"""
+    try:
+        while True:
+            chunk = f.read(FILE_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        f.close()
@@ -0,0 +1,256 @@
+import os
+import random
+import logging
+import time
+from datetime import datetime, timezone
+import redis
+import redis.asyncio as aioredis
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", "0.5"))  # seconds, keep small so fallback to Postgres is quick
+
+LEVELS = ["gold", "silver", "bronze"]
+
+# How many members random_proxy samples when weighting by latency
+RANDOM_SAMPLE = int(os.getenv("PICK_RANDOM_SAMPLE", "8"))
+# Members per ZRANGE when streaming, same knob as the Postgres cursor
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", "500"))
+# Older stats snapshots are recomputed from Postgres by the API (the worker refreshes every batch)
+STATS_MAX_AGE = int(os.getenv("STATS_MAX_AGE", "300")) # seconds
+
+# Layout:
+#   hotpool:{level}               ZSET  member "ip:port", score latency (ms)
+#   hotpool:user:{email}:{level}  ZSET  same, only proxies assigned to that user
+#   hotpool:info                  HASH  "ip:port" -> country
+#   hotpool:stats                 HASH  /api/proxies/stats fields + snapshot_at (unix time)
+INFO_KEY = "hotpool:info"
+STATS_KEY = "hotpool:stats"
+STATS_COUNTS = ["gold", "silver", "bronze", "total"]
+
+def pool_key(level: str, user_email: str = None):
+    if user_email:
+        return f"hotpool:user:{user_email}:{level}"
+    return f"hotpool:{level}"
+
+def stats_snapshot(stats, snapshot_at: float):
+    """Stats as served by /api/proxies/stats, with the time they were computed"""
+    snapshot = dict(stats)
+    snapshot["snapshot_at"] = datetime.fromtimestamp(snapshot_at, timezone.utc).isoformat()
+    return snapshot
+
+# --- Worker side (sync) ---
+
+_sync_client = None
+
+def get_sync_client():
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = redis.Redis.from_url(
+            REDIS_URL, decode_responses=True,
+            socket_timeout=REDIS_TIMEOUT, socket_connect_timeout=REDIS_TIMEOUT,
+        )
+    return _sync_client
+
+def publish_batch(batch_results, assigned=None):
+    """
+    Push one checked batch into the level pools.
+    batch_results: {"gold": [{"proxy": "IP:PORT", "country": ..., "latency": ...}], ...}
+    assigned: {"IP:PORT": email} for rows that belong to a user
+    """
+    assigned = assigned or {}
+    try:
+        pipe = get_sync_client().pipeline(transaction=False)
+        for level, items in batch_results.items():
+            other_levels = [l for l in LEVELS if l != level]
+            for item in items:
+                member = item["proxy"]
+                owners = [None]
+                if assigned.get(member):
+                    owners.append(assigned[member])
+                for owner in owners:
+                    # A proxy can move between levels from one check to the next
+                    for other in other_levels:
+                        pipe.zrem(pool_key(other, owner), member)
+                    pipe.zadd(pool_key(level, owner), {member: item["latency"]})
+                pipe.hset(INFO_KEY, member, item["country"])
+        pipe.execute()
+    except redis.RedisError as e:
+        logging.warning(f"Hot pool publish skipped, Redis unavailable: {e}")
+
+def remove_batch(rows):
+    """
+    Drop deleted proxies from every pool they may be in.
+    rows: [("IP:PORT", assigned_to or None), ...]
+    """
+    try:
+        pipe = get_sync_client().pipeline(transaction=False)
+        for member, owner in rows:
+            for level in LEVELS:
+                pipe.zrem(pool_key(level), member)
+                if owner:
+                    pipe.zrem(pool_key(level, owner), member)
+            pipe.hdel(INFO_KEY, member)
+        pipe.execute()
+    except redis.RedisError as e:
+        logging.warning(f"Hot pool removal skipped, Redis unavailable: {e}")
+
+def publish_assigned(user_email: str, rows):
+    """Worker-side twin of HotPool.add_assigned, for the allocator's top-ups"""
+    if not rows:
+        return
+    try:
+        pipe = get_sync_client().pipeline(transaction=False)
+        for row in rows:
+            pipe.zadd(pool_key(row["level"], user_email), {row["proxy"]: row["latency"]})
+            pipe.hset(INFO_KEY, row["proxy"], row["country"] or "Unknown")
+        pipe.execute()
+    except redis.RedisError as e:
+        logging.warning(f"Hot pool update skipped, Redis unavailable: {e}")
+
+def publish_stats(stats):
+    """Store a get_stats() result as the snapshot served by /api/proxies/stats"""
+    try:
+        get_sync_client().hset(STATS_KEY, mapping=dict(stats, snapshot_at=time.time()))
+    except redis.RedisError as e:
+        logging.warning(f"Stats snapshot skipped, Redis unavailable: {e}")
+
+# --- API side (async) ---
+
+class HotPool:
+    """
+    Read path for /api/proxies/random, /api/proxies/external and /api/proxies/stats.
+    Every method returns None when Redis is down or has nothing for the
+    caller, which tells the router to fall back to Postgres.
+    """
+
+    def __init__(self, url: str = REDIS_URL):
+        self.client = aioredis.from_url(
+            url, decode_responses=True,
+            socket_timeout=REDIS_TIMEOUT, socket_connect_timeout=REDIS_TIMEOUT,
+        )
+
+    async def random_proxy(self, user_email: str = None, weighted: bool = False):
+        """
+        Pick one proxy from gold+silver (bronze if those are empty).
+        weighted=True samples a few members and favours low latency.
+        """
+        sample = RANDOM_SAMPLE if weighted else 1
+        try:
+            for levels in (["gold", "silver"], ["bronze"]):
+                keys = [pool_key(level, user_email) for level in levels]
+                pipe = self.client.pipeline(transaction=False)
+                for key in keys:
+                    pipe.zcard(key)
+                sizes = await pipe.execute()
+
+                total = sum(sizes)
+                if not total:
+                    continue
+
+                # Map random indexes onto the concatenated sets: O(log n) per pick
+                pipe = self.client.pipeline(transaction=False)
+                for _ in range(sample):
+                    index = random.randrange(total)
+                    for key, size in zip(keys, sizes):
+                        if index < size:
+                            pipe.zrange(key, index, index, withscores=True)
+                            break
+                        index -= size
+                picked = [hit[0] for hit in await pipe.execute() if hit]
+
+                if not picked:
+                    # Sets shrank between ZCARD and ZRANGE, let Postgres answer
+                    return None
+                if weighted:
+                    member, latency = random.choices(picked, weights=[1.0 / max(score, 1) for _, score in picked])[0]
+                else:
+                    member, latency = picked[0]
+                country = await self.client.hget(INFO_KEY, member)
+                return {"proxy": member, "latency": int(latency), "country": country or "Unknown"}
+        except redis.RedisError as e:
+            logging.warning(f"Hot pool read failed, falling back to Postgres: {e}")
+        return None
+
+    async def has_proxies(self, user_email: str = None):
+        """True if the caller's pools have members, None if empty or Redis is down."""
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for level in LEVELS:
+                pipe.zcard(pool_key(level, user_email))
+            return True if sum(await pipe.execute()) else None
+        except redis.RedisError as e:
+            logging.warning(f"Hot pool read failed, falling back to Postgres: {e}")
+        return None
+
+    async def stream_top_proxies(self, limit: int, user_email: str = None):
+        """
+        Async generator of "ip:port\n" text for the first `limit` members,
+        gold -> silver -> bronze then by latency, one ZRANGE of
+        STREAM_CHUNK_SIZE per chunk. Stops early if Redis goes away mid-stream.
+        """
+        sent = 0
+        try:
+            for level in LEVELS:
+                start = 0
+                while sent < limit:
+                    count = min(STREAM_CHUNK_SIZE, limit - sent)
+                    members = await self.client.zrange(pool_key(level, user_email), start, start + count - 1)
+                    if members:
+                        yield "".join(f"{member}\n" for member in members)
+                        sent += len(members)
+                        start += len(members)
+                    if len(members) < count:
+                        break
+        except redis.RedisError as e:
+            logging.warning(f"Hot pool stream cut short after {sent} proxies: {e}")
+
+    async def get_stats(self):
+        """The worker's stats snapshot, or None if missing, older than STATS_MAX_AGE or Redis is down."""
+        try:
+            raw = await self.client.hgetall(STATS_KEY)
+        except redis.RedisError as e:
+            logging.warning(f"Stats snapshot read failed, falling back to Postgres: {e}")
+            return None
+        if not raw or "snapshot_at" not in raw:
+            return None
+        snapshot_at = float(raw["snapshot_at"])
+        if time.time() - snapshot_at > STATS_MAX_AGE:
+            return None
+        stats = {key: int(raw.get(key, 0)) for key in STATS_COUNTS}
+        stats["last_updated"] = raw.get("last_updated", "Never")
+        return stats_snapshot(stats, snapshot_at)
+
+    async def set_stats(self, stats):
+        """Store stats computed by the API so the next polls read them from Redis. Returns the snapshot."""
+        snapshot_at = time.time()
+        try:
+            await self.client.hset(STATS_KEY, mapping=dict(stats, snapshot_at=snapshot_at))
+        except redis.RedisError as e:
+            logging.warning(f"Stats snapshot skipped, Redis unavailable: {e}")
+        return stats_snapshot(stats, snapshot_at)
+
+    async def add_assigned(self, user_email: str, rows):
+        """Mirror proxies newly assigned in Postgres into the user's pools."""
+        if not rows:
+            return
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for row in rows:
+                pipe.zadd(pool_key(row["level"], user_email), {row["proxy"]: row["latency"]})
+                pipe.hset(INFO_KEY, row["proxy"], row["country"] or "Unknown")
+            await pipe.execute()
+        except redis.RedisError as e:
+            logging.warning(f"Hot pool update skipped, Redis unavailable: {e}")
+
+    async def clear(self):
+        try:
+            keys = [key async for key in self.client.scan_iter(match="hotpool:*")]
+            if keys:
+                await self.client.delete(*keys)
+        except redis.RedisError as e:
+            logging.warning(f"Hot pool clear skipped, Redis unavailable: {e}")
+
+    async def close(self):
+        await self.client.aclose()
+
+hot_pool = HotPool()
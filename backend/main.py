@@ -1,7 +1,9 @@
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
-from router import router
+from router import router, allocate
+from async_database import db
+from hot_pool import hot_pool
 from auth import authenticate_user, create_access_token, oauth2_scheme, get_current_user_obj, init_auth, ACCESS_TOKEN_EXPIRE_MINUTES
 from datetime import timedelta
 import secrets
@@ -15,10 +17,20 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # /api/proxies/{level} returns a plain list and sends the next page cursor here
+    expose_headers=["X-Next-Cursor"],
 )
 
 @app.on_event("startup")
 async def startup_event():
+    # Open the async DB pool used by the API handlers
+    await db.open()
+    # API key prefixes for rejecting unknown keys in memory
+    try:
+        await db.load_issued_prefixes()
+    except Exception as e:
+        print(f"Could not load API key prefixes, loading on first use: {e}")
+
     # Initialize DB and Auth
     print("Starting up... Initializing Auth...")
     try:
@@ -26,10 +38,15 @@ async def startup_event():
     except Exception as e:
         print(f"Error during startup auth init: {e}")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await db.close()
+    await hot_pool.close()
+
 @app.post("/token")
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     # OAuth2PasswordRequestForm has 'username' field, we use it for email
-    user = authenticate_user(form_data.username, form_data.password)
+    user = await authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -37,6 +54,11 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Login is the first event for a new user: give them their quota now rather
+    # than waiting for the worker's next allocator pass
+    if not user["is_admin"]:
+        await allocate(user["email"])
+    
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user["email"]}, expires_delta=access_token_expires
@@ -0,0 +1,307 @@
+import logging
+
+# The (ip, port)-keyed proxies table. Migration 5 rebuilds the legacy table
+# into it and the baseline creates it directly.
+PROXIES_TABLE = '''
+        CREATE TABLE {name} (
+            ip INET NOT NULL,
+            port INTEGER NOT NULL,
+            latency INTEGER,
+            country TEXT,
+            country_code TEXT,
+            level TEXT,
+            last_checked TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            assigned_to TEXT,
+            lat REAL,
+            lon REAL,
+            rand_key DOUBLE PRECISION DEFAULT random(),
+            PRIMARY KEY (ip, port)
+        )
+        '''
+
+# Indexes of the keyed table that later migrations keep. Migration 5 recreates
+# these; benchmarks/bench_proxy_indexes.py measures them.
+PROXIES_INDEXES = [
+    # top_up picks the fastest unassigned rows
+    "CREATE INDEX IF NOT EXISTS idx_proxies_unassigned_latency ON proxies (latency) WHERE assigned_to IS NULL",
+    # pick_random seeks
+    "CREATE INDEX IF NOT EXISTS idx_proxies_rand_key ON proxies (rand_key)",
+    "CREATE INDEX IF NOT EXISTS idx_proxies_assigned_rand_key ON proxies (assigned_to, rand_key)",
+    # retention stale-row scan
+    "CREATE INDEX IF NOT EXISTS idx_proxies_last_checked ON proxies (last_checked)",
+]
+
+# Gold -> silver -> bronze as a sortable number. Queries must use this exact
+# text for Postgres to match the indexes built on it in migration 6.
+LEVEL_RANK = "(CASE level WHEN 'gold' THEN 0 WHEN 'silver' THEN 1 ELSE 2 END)"
+
+# ORDER BY LEVEL_RANK, latency LIMIT n reads these in order, no sort step
+RANK_INDEXES = [
+    f"CREATE INDEX IF NOT EXISTS idx_proxies_rank_latency ON proxies ({LEVEL_RANK}, latency)",
+    f"CREATE INDEX IF NOT EXISTS idx_proxies_assigned_rank_latency ON proxies (assigned_to, {LEVEL_RANK}, latency)",
+]
+
+# WHERE (latency, ip, port) > cursor ORDER BY latency, ip, port LIMIT n is one
+# range scan on these
+KEYSET_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_proxies_latency_key ON proxies (latency, ip, port)",
+    "CREATE INDEX IF NOT EXISTS idx_proxies_level_latency_key ON proxies (level, latency, ip, port)",
+    "CREATE INDEX IF NOT EXISTS idx_proxies_assigned_latency_key ON proxies (assigned_to, latency, ip, port)",
+]
+
+# The "ip:port" text proxy_state is keyed on, computed from a keyed proxies
+# row. Joins must use this exact text to use the index built on it in
+# migration 10 (port::text keeps the expression immutable).
+PROXY_ENDPOINT = "(host(ip) || ':' || port::text)"
+
+# One dotted quad, each octet 0-255, so the ::inet cast in migration 5 cannot fail
+IPV4_PATTERN = "^((25[0-5]|2[0-4][0-9]|1?[0-9]?[0-9])[.]){3}(25[0-5]|2[0-4][0-9]|1?[0-9]?[0-9])$"
+
+# Versioned schema changes. Each entry runs once per database, in order, and
+# is recorded in schema_migrations. Append new entries; never edit applied ones.
+MIGRATIONS = [
+    (1, "proxies hot path indexes", [
+        # Columns older installs added ad hoc in init_db; the indexes below
+        # and the migration 5 rebuild read them
+        "ALTER TABLE proxies ADD COLUMN IF NOT EXISTS ip TEXT",
+        "ALTER TABLE proxies ADD COLUMN IF NOT EXISTS port TEXT",
+        "ALTER TABLE proxies ADD COLUMN IF NOT EXISTS lat REAL",
+        "ALTER TABLE proxies ADD COLUMN IF NOT EXISTS lon REAL",
+        "ALTER TABLE proxies ADD COLUMN IF NOT EXISTS rand_key DOUBLE PRECISION DEFAULT random()",
+        # get_proxies(level) / stats per level, ordered by latency
+        "CREATE INDEX IF NOT EXISTS idx_proxies_level_latency ON proxies (level, latency)",
+        # assign_proxies picks the fastest unassigned rows
+        "CREATE INDEX IF NOT EXISTS idx_proxies_unassigned_latency ON proxies (latency) WHERE assigned_to IS NULL",
+        # per-user reads and COUNT(*) WHERE assigned_to = %s
+        "CREATE INDEX IF NOT EXISTS idx_proxies_assigned_latency ON proxies (assigned_to, latency)",
+        # admin get_all_proxies: ORDER BY latency without a filter
+        "CREATE INDEX IF NOT EXISTS idx_proxies_latency ON proxies (latency)",
+        # pick_random seeks (previously created ad hoc in init_db)
+        "CREATE INDEX IF NOT EXISTS idx_proxies_rand_key ON proxies (rand_key)",
+        "CREATE INDEX IF NOT EXISTS idx_proxies_assigned_rand_key ON proxies (assigned_to, rand_key)",
+        "ANALYZE proxies",
+    ]),
+    (2, "proxy_state for the recheck scheduler", [
+        # One row per scraped ip:port, maintained by worker/recheck.py
+        '''
+        CREATE TABLE IF NOT EXISTS proxy_state (
+            proxy TEXT PRIMARY KEY,
+            next_check_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            failure_streak INTEGER NOT NULL DEFAULT 0,
+            last_latency INTEGER,
+            last_level TEXT,
+            last_checked TIMESTAMP,
+            first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Due scan, ordered the way SELECT_DUE_SQL picks candidates
+        "CREATE INDEX IF NOT EXISTS idx_proxy_state_due ON proxy_state (next_check_at, failure_streak, last_latency)",
+    ]),
+    (3, "retention: last_seen and expiry indexes", [
+        # Last scrape that listed the proxy, so ones no source carries any more can be dropped
+        "ALTER TABLE proxy_state ADD COLUMN IF NOT EXISTS last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP",
+        "CREATE INDEX IF NOT EXISTS idx_proxy_state_last_seen ON proxy_state (last_seen)",
+        "CREATE INDEX IF NOT EXISTS idx_proxy_state_failures ON proxy_state (failure_streak)",
+        # Stale-row scan in worker/retention.py
+        "CREATE INDEX IF NOT EXISTS idx_proxies_last_checked ON proxies (last_checked)",
+        # Joining proxies to proxy_state on ip:port
+        "CREATE INDEX IF NOT EXISTS idx_proxies_ip_port ON proxies ((ip || ':' || port))",
+    ]),
+    (4, "geoip_cache shared between worker runs", [
+        '''
+        CREATE TABLE IF NOT EXISTS geoip_cache (
+            ip TEXT PRIMARY KEY,
+            country TEXT,
+            country_code TEXT,
+            lat REAL,
+            lon REAL,
+            resolved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_geoip_cache_resolved_at ON geoip_cache (resolved_at)",
+    ]),
+    (5, "key proxies on (ip inet, port integer)", [
+        # The legacy key was the text 'ip:port:country:code', so one endpoint
+        # with two geo answers was two rows. Rebuild keyed on the endpoint.
+        PROXIES_TABLE.format(name="proxies_keyed"),
+        # Older rows may lack ip/port/country columns; the key string has them.
+        # Of duplicates keep the assigned row, then the most recently checked.
+        # Rows whose address is not a valid IPv4 endpoint are dropped.
+        f'''
+        INSERT INTO proxies_keyed (ip, port, latency, country, country_code, level, last_checked, assigned_to, lat, lon, rand_key)
+        SELECT DISTINCT ON (ip_text::inet, port_text::integer)
+            ip_text::inet, port_text::integer, latency, country, country_code, level, last_checked, assigned_to, lat, lon, rand_key
+        FROM (
+            SELECT
+                COALESCE(NULLIF(ip, ''), split_part(proxy, ':', 1)) AS ip_text,
+                COALESCE(NULLIF(port, ''), split_part(proxy, ':', 2)) AS port_text,
+                latency,
+                COALESCE(country, NULLIF(split_part(proxy, ':', 3), ''), 'Unknown') AS country,
+                COALESCE(country_code, NULLIF(split_part(proxy, ':', 4), ''), 'UN') AS country_code,
+                level, last_checked, assigned_to, lat, lon,
+                COALESCE(rand_key, random()) AS rand_key
+            FROM proxies
+        ) legacy
+        WHERE ip_text ~ '{IPV4_PATTERN}'
+          AND CASE WHEN port_text ~ '^[0-9]{{1,5}}$' THEN port_text::integer BETWEEN 1 AND 65535 ELSE false END
+        ORDER BY ip_text::inet, port_text::integer, (assigned_to IS NOT NULL) DESC, last_checked DESC NULLS LAST
+        ''',
+        "DROP TABLE proxies",
+        "ALTER TABLE proxies_keyed RENAME TO proxies",
+        "ALTER TABLE proxies RENAME CONSTRAINT proxies_keyed_pkey TO proxies_pkey",
+        *PROXIES_INDEXES,
+        "ANALYZE proxies",
+    ]),
+    (6, "level-rank indexes for streamed exports", RANK_INDEXES),
+    (7, "keyset pagination indexes", [
+        *KEYSET_INDEXES,
+        # They supersede the (…, latency) ones
+        "DROP INDEX IF EXISTS idx_proxies_latency",
+        "DROP INDEX IF EXISTS idx_proxies_level_latency",
+        "DROP INDEX IF EXISTS idx_proxies_assigned_latency",
+        "ANALYZE proxies",
+    ]),
+    (8, "hashed API keys", [
+        # Raw key column older installs added ad hoc in init_db; hash_stored_keys reads it
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS api_key TEXT UNIQUE",
+        # HMAC of the key (api_keys.py); raw keys are moved over by hash_stored_keys
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS api_key_hash TEXT",
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS api_key_prefix TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_users_api_key_hash ON users (api_key_hash)",
+    ]),
+    (9, "cached per-user assigned count", [
+        # Kept by the allocator (database.top_up, worker/allocator.py) so
+        # finding users below quota does not count proxies per user
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS assigned_count INTEGER NOT NULL DEFAULT 0",
+        "UPDATE users u SET assigned_count = (SELECT COUNT(*) FROM proxies p WHERE p.assigned_to = u.email)",
+    ]),
+    (10, "proxies endpoint index for proxy_state joins", [
+        # Replaces idx_proxies_ip_port (migration 3), lost in the migration 5 rebuild;
+        # worker/retention.py joins dead proxy_state rows to proxies on it
+        f"CREATE INDEX IF NOT EXISTS idx_proxies_endpoint ON proxies ({PROXY_ENDPOINT})",
+    ]),
+]
+
+# The schema migrations 1..BASELINE_VERSION end at, created in one go. A fresh
+# database (no tables yet) gets this instead of building the legacy tables and
+# rebuilding them; those versions are then recorded as applied. Migrations
+# appended later run after it as usual, so it never needs to change.
+BASELINE_VERSION = 9
+BASELINE = [
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        email TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        proxy_limit INTEGER DEFAULT 10,
+        is_admin BOOLEAN DEFAULT FALSE,
+        api_key TEXT UNIQUE,
+        api_key_hash TEXT,
+        api_key_prefix TEXT,
+        assigned_count INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_users_api_key_hash ON users (api_key_hash)",
+    '''
+    CREATE TABLE IF NOT EXISTS proxy_history (
+        id SERIAL PRIMARY KEY,
+        timestamp TEXT NOT NULL,
+        gold_count INTEGER DEFAULT 0,
+        silver_count INTEGER DEFAULT 0,
+        bronze_count INTEGER DEFAULT 0
+    )
+    ''',
+    PROXIES_TABLE.format(name="proxies"),
+    *PROXIES_INDEXES,
+    *RANK_INDEXES,
+    *KEYSET_INDEXES,
+    '''
+    CREATE TABLE IF NOT EXISTS proxy_state (
+        proxy TEXT PRIMARY KEY,
+        next_check_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        failure_streak INTEGER NOT NULL DEFAULT 0,
+        last_latency INTEGER,
+        last_level TEXT,
+        last_checked TIMESTAMP,
+        first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_proxy_state_due ON proxy_state (next_check_at, failure_streak, last_latency)",
+    "CREATE INDEX IF NOT EXISTS idx_proxy_state_last_seen ON proxy_state (last_seen)",
+    "CREATE INDEX IF NOT EXISTS idx_proxy_state_failures ON proxy_state (failure_streak)",
+    '''
+    CREATE TABLE IF NOT EXISTS geoip_cache (
+        ip TEXT PRIMARY KEY,
+        country TEXT,
+        country_code TEXT,
+        lat REAL,
+        lon REAL,
+        resolved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_geoip_cache_resolved_at ON geoip_cache (resolved_at)",
+]
+
+# Arbitrary constant so backend and worker don't migrate concurrently
+MIGRATION_LOCK_ID = 727001
+
+def apply_migrations(conn):
+    """Apply pending MIGRATIONS on `conn` (a psycopg2 connection). Returns the versions applied."""
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+
+    applied = []
+    cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    try:
+        cursor.execute("SELECT version FROM schema_migrations")
+        done = {row[0] for row in cursor.fetchall()}
+
+        cursor.execute("SELECT to_regclass('proxies') IS NULL AND to_regclass('users') IS NULL")
+        if not done and cursor.fetchone()[0]:
+            try:
+                for statement in BASELINE:
+                    cursor.execute(statement)
+                for version, name, _ in MIGRATIONS:
+                    if version <= BASELINE_VERSION:
+                        cursor.execute(
+                            "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                            (version, name)
+                        )
+                        done.add(version)
+                conn.commit()
+                print(f"Created schema at migration {BASELINE_VERSION}")
+            except Exception as e:
+                conn.rollback()
+                logging.error(f"Baseline schema failed: {e}")
+                raise
+
+        for version, name, statements in MIGRATIONS:
+            if version in done:
+                continue
+            try:
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                    (version, name)
+                )
+                conn.commit()
+                applied.append(version)
+                print(f"Applied migration {version}: {name}")
+            except Exception as e:
+                conn.rollback()
+                logging.error(f"Migration {version} ({name}) failed: {e}")
+                raise
+    finally:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        conn.commit()
+
+    return applied
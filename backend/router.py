@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from database import redis_client
+from async_database import db
+from database import get_pool, EXPORT_COLUMNS, ADMIN_PAGE_SIZE, PAGE_SIZE_MAX, parse_fields, decode_cursor
+import api_keys
+from exports import build_xlsx, csv_chunks, ndjson_chunks, iter_file
+from hot_pool import hot_pool
 from pydantic import BaseModel
-import openpyxl
-from fastapi.responses import FileResponse, Response
+from fastapi.responses import FileResponse, Response, StreamingResponse
 import os
-from io import BytesIO
 from auth import get_current_user_obj, get_dual_auth_user
 
 router = APIRouter()
@@ -20,93 +22,97 @@ class UserSignup(BaseModel):
 
 # Signup endpoint removed for single-user mode
 
+async def allocate(email: str):
+    """
+    Top up one user's proxies after an event that changes their quota and
+    mirror new assignments into the hot pool. Read endpoints never call this;
+    the worker's allocator covers deaths and new supply.
+    """
+    assigned = await db.top_up_user(email)
+    await hot_pool.add_assigned(email, assigned)
+
 @router.get("/api/me")
 async def get_current_user_info(current_user: dict = Depends(get_current_user_obj)):
     return {
         "email": current_user["email"],
         "is_admin": current_user["is_admin"],
         "proxy_limit": current_user["proxy_limit"],
-        "api_key": current_user.get("api_key")
+        # Only the hash is stored; the full key is shown once, by /api/key/generate
+        "api_key": api_keys.mask(current_user.get("api_key_prefix"))
     }
 
-@router.get("/api/proxies/all")
-async def get_all_proxies(current_user: dict = Depends(get_current_user_obj)): 
-    # Use the user's proxy limit
-    limit = current_user["proxy_limit"]
-    email = current_user["email"]
-    is_admin = current_user["is_admin"]
-    
-    # Ensure proxies are assigned
-    if not is_admin:
-        redis_client.assign_proxies(email, limit)
-    
-    # Return full structure
-    return redis_client.get_all_proxies(limit=limit if not is_admin else None, user_email=email, is_admin=is_admin)
+def page_request(current_user: dict, page_size: int = None, cursor: str = None, fields: str = None):
+    """
+    Validate ?page_size=&cursor=&fields= into (limit, fields, after).
+    Users never get more than their proxy_limit. Admins, who see the whole
+    table, get ADMIN_PAGE_SIZE rows unless they ask for another page_size;
+    further rows are reached with next_cursor.
+    """
+    if page_size is not None and page_size < 1:
+        raise HTTPException(status_code=400, detail="page_size must be positive")
+    try:
+        fields = parse_fields(fields)
+        after = decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if current_user["is_admin"]:
+        limit = min(page_size or ADMIN_PAGE_SIZE, PAGE_SIZE_MAX)
+    else:
+        limit = min(page_size or current_user["proxy_limit"], current_user["proxy_limit"], PAGE_SIZE_MAX)
+    return limit, fields, after
 
-@router.get("/api/proxies/{level}")
-async def get_proxies_by_level(level: str, current_user: dict = Depends(get_current_user_obj)):
-    if level not in ["gold", "silver", "bronze"]:
-        raise HTTPException(status_code=400, detail="Invalid level")
-    
-    limit = current_user["proxy_limit"]
+@router.get("/api/proxies/all")
+async def get_all_proxies(page_size: int = None, cursor: str = None, fields: str = None, current_user: dict = Depends(get_current_user_obj)): 
+    limit, fields, after = page_request(current_user, page_size, cursor, fields)
     email = current_user["email"]
     is_admin = current_user["is_admin"]
     
-    if not is_admin:
-        redis_client.assign_proxies(email, limit)
-        
-    return redis_client.get_proxies(level, limit=limit if not is_admin else None, user_email=email, is_admin=is_admin)
+    # Return full structure; next_cursor is set when another page follows
+    return await db.get_all_proxies(limit=limit, user_email=email, is_admin=is_admin, fields=fields, after=after)
 
 @router.get("/api/proxies/stats")
 async def get_stats():
-    return redis_client.get_stats()
+    # Snapshot refreshed by the worker after every batch; Postgres only when it is missing or stale
+    stats = await hot_pool.get_stats()
+    if stats is None:
+        stats = await hot_pool.set_stats(await db.get_stats())
+    return stats
+
+def export_source(current_user: dict):
+    """Row chunks for the export endpoints; exports respect the user's limit too"""
+    return db.stream_rows(
+        current_user["proxy_limit"],
+        user_email=current_user["email"],
+        is_admin=current_user["is_admin"],
+        columns=EXPORT_COLUMNS,
+    )
 
 @router.get("/api/proxies/export/excel")
 async def export_excel(current_user: dict = Depends(get_current_user_obj)):
-    # Export respects limit too
-    limit = current_user["proxy_limit"]
-    data = redis_client.get_all_proxies(limit=limit, user_email=current_user["email"], is_admin=current_user["is_admin"])
-    
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Proxies"
-    
-    # Headers
-    headers = ["IP", "Port", "Country", "Country Code", "Latency (ms)", "Level"]
-    ws.append(headers)
-    
-    for level in ["gold", "silver", "bronze"]:
-        for p in data[level]:
-            # p["proxy"] is "IP:PORT:COUNTRY:CODE"
-            parts = p["proxy"].split(":")
-            ip = parts[0]
-            port = parts[1] if len(parts) > 1 else ""
-            country = parts[2] if len(parts) > 2 else "Unknown"
-            country_code = parts[3] if len(parts) > 3 else ""
-            
-            ws.append([
-                ip,
-                port,
-                country,
-                country_code,
-                p["latency"],
-                level
-            ])
-
-    # Save to buffer
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    
+    spool = await build_xlsx(export_source(current_user))
     headers = {
         'Content-Disposition': 'attachment; filename="proxies.xlsx"'
     }
-    
-    return Response(content=buffer.getvalue(), headers=headers, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    return StreamingResponse(iter_file(spool), headers=headers, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+@router.get("/api/proxies/export/csv")
+async def export_csv(current_user: dict = Depends(get_current_user_obj)):
+    headers = {
+        'Content-Disposition': 'attachment; filename="proxies.csv"'
+    }
+    return StreamingResponse(csv_chunks(export_source(current_user)), headers=headers, media_type="text/csv")
+
+@router.get("/api/proxies/export/ndjson")
+async def export_ndjson(current_user: dict = Depends(get_current_user_obj)):
+    headers = {
+        'Content-Disposition': 'attachment; filename="proxies.ndjson"'
+    }
+    return StreamingResponse(ndjson_chunks(export_source(current_user)), headers=headers, media_type="application/x-ndjson")
 
 @router.get("/api/history")
 async def get_history():
-    return redis_client.get_history()
+    return await db.get_history()
 
 @router.post("/api/worker/start")
 async def start_worker(current_user: dict = Depends(get_current_user_obj)):
@@ -128,7 +134,8 @@ async def stop_worker(current_user: dict = Depends(get_current_user_obj)):
 async def clear_data(current_user: dict = Depends(get_current_user_obj)):
     if not current_user["is_admin"]:
         raise HTTPException(status_code=403, detail="Not authorized")
-    redis_client.clear_proxies()
+    await db.clear_proxies()
+    await hot_pool.clear()
     return {"message": "All proxy data cleared"}
 
 # Admin Endpoint
@@ -137,19 +144,23 @@ async def upgrade_user(upgrade_data: UserUpgrade, current_user: dict = Depends(g
     if not current_user["is_admin"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    redis_client.update_user_limit(upgrade_data.email, upgrade_data.new_limit)
+    await db.update_user_limit(upgrade_data.email, upgrade_data.new_limit)
+    await allocate(upgrade_data.email)
     return {"message": f"User {upgrade_data.email} upgraded to {upgrade_data.new_limit} proxies"}
 
+@router.get("/api/admin/metrics")
+async def get_metrics(current_user: dict = Depends(get_current_user_obj)):
+    if not current_user["is_admin"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return {"db_pool": db.pool_stats(), "sync_db_pool": get_pool().stats(), "user_cache": db.user_cache_stats(), "invalid_api_keys": db.invalid_key_stats()}
+
 # Public/External API (Protected by token still, but maybe different rate limits later)
 @router.get("/api/proxies/external")
 async def get_external_proxies(limit: int = None, current_user: dict = Depends(get_dual_auth_user)):
     # Ensure they don't exceed their assigned limit
     user_limit = current_user["proxy_limit"]
     email = current_user["email"]
-    
-    # Ensure proxies are assigned (even for API users)
-    if not current_user["is_admin"]:
-        redis_client.assign_proxies(email, user_limit)
+    is_admin = current_user["is_admin"]
         
     # If limit is not provided or greater than user_limit, use user_limit (return all assigned)
     if limit is None or limit > user_limit:
@@ -157,89 +168,79 @@ async def get_external_proxies(limit: int = None, current_user: dict = Depends(g
     else:
         actual_limit = limit
     
-    all_data = redis_client.get_all_proxies(limit=actual_limit, user_email=email, is_admin=current_user["is_admin"])
-    # Flatten the list
-    flat_list = []
+    # Stream "ip:port" lines as they are read, gold -> silver -> bronze by latency.
+    # Fast path: Redis pools are already in that order
+    pool_owner = None if is_admin else email
+    if await hot_pool.has_proxies(pool_owner):
+        return StreamingResponse(hot_pool.stream_top_proxies(actual_limit, pool_owner), media_type="text/plain")
     
-    # Prioritize Gold -> Silver -> Bronze
-    for level in ["gold", "silver", "bronze"]:
-        if level in all_data:
-            for p in all_data[level]:
-                 # p["proxy"] is "IP:PORT:COUNTRY:CODE"
-                 # We just want IP:PORT
-                parts = p["proxy"].split(":")
-                if len(parts) >= 2:
-                    flat_list.append(f"{parts[0]}:{parts[1]}")
-        
-    return Response(content="\n".join(flat_list[:actual_limit]), media_type="text/plain")
-
-    return Response(content="\n".join(flat_list[:actual_limit]), media_type="text/plain")
+    # Fallback: server-side cursor, ordered by the level-rank index
+    return StreamingResponse(db.stream_proxies(actual_limit, user_email=email, is_admin=is_admin), media_type="text/plain")
 
 @router.get("/api/proxies/random")
-async def get_random_proxy(format: str = "json", current_user: dict = Depends(get_dual_auth_user)):
+async def get_random_proxy(format: str = "json", weighted: bool = False, current_user: dict = Depends(get_dual_auth_user)):
     """
     Returns a single random high-quality proxy (Gold or Silver).
     format: 'json' (default) or 'text'
+    weighted: favour lower-latency proxies instead of a uniform pick
     """
-    import random
-    
-    # Get all proxies (admin gets all, user gets assigned)
-    limit = current_user["proxy_limit"]
+    # Admin picks from everything, user from their assigned proxies
     email = current_user["email"]
     is_admin = current_user["is_admin"]
     
-    if not is_admin:
-        redis_client.assign_proxies(email, limit)
-        
-    all_data = redis_client.get_all_proxies(limit=limit if not is_admin else None, user_email=email, is_admin=is_admin)
-    
-    # Pool of good proxies
-    candidates = []
-    if "gold" in all_data:
-        candidates.extend(all_data["gold"])
-    if "silver" in all_data:
-        candidates.extend(all_data["silver"])
-        
-    # Fallback to bronze if no good ones
-    if not candidates and "bronze" in all_data:
-        candidates.extend(all_data["bronze"])
-        
-    if not candidates:
-        raise HTTPException(status_code=404, detail="No proxies available")
-        
-    # Pick one
-    chosen = random.choice(candidates)
-    
-    # Format: IP:PORT
-    parts = chosen["proxy"].split(":")
-    ip_port = f"{parts[0]}:{parts[1]}"
+    # Fast path: pick straight from the Redis pools
+    chosen = await hot_pool.random_proxy(user_email=None if is_admin else email, weighted=weighted)
+    if not chosen:
+        # Fallback: random index seek in Postgres, bronze only if no good ones
+        chosen = await db.pick_random(["gold", "silver"], user_email=email, is_admin=is_admin, weighted=weighted)
+        if not chosen:
+            chosen = await db.pick_random(["bronze"], user_email=email, is_admin=is_admin, weighted=weighted)
+            
+        if not chosen:
+            raise HTTPException(status_code=404, detail="No proxies available")
     
+    # Both paths give "proxy" as IP:PORT
     if format == "text":
-        return Response(content=ip_port, media_type="text/plain")
+        return Response(content=chosen["proxy"], media_type="text/plain")
     
     return {
-        "proxy": ip_port,
+        "proxy": chosen["proxy"],
         "protocol": "http",
-        "country": parts[2] if len(parts) > 2 else "Unknown",
+        "country": chosen["country"] or "Unknown",
         "latency": chosen["latency"]
     }
 
 # --- API Key Management ---
 @router.post("/api/key/generate")
 async def generate_api_key(current_user: dict = Depends(get_current_user_obj)):
-    """Generate or Regenerate a permanent API Key"""
-    import uuid
-    new_key = f"sk_live_{uuid.uuid4().hex}"
-    redis_client.update_api_key(current_user["email"], new_key)
+    """Generate or Regenerate a permanent API Key. The response is the only time the full key is shown."""
+    new_key = api_keys.generate_api_key()
+    await db.update_api_key(current_user["email"], new_key)
     return {"api_key": new_key}
 
 @router.get("/api/key")
 async def get_api_key(current_user: dict = Depends(get_current_user_obj)):
-    """Get current API Key"""
+    """Get the current API Key, masked (only its hash is stored)"""
     # Re-fetch user to get latest key
-    user = redis_client.get_user_by_email(current_user["email"])
-    return {"api_key": user.get("api_key")}
+    user = await db.get_user_by_email(current_user["email"])
+    return {"api_key": api_keys.mask(user.get("api_key_prefix")), "masked": True}
 
 @router.get("/api/history")
 async def get_history():
-    return redis_client.get_history()
+    return await db.get_history()
+
+# Keep last: the {level} path parameter would otherwise shadow /api/proxies/stats, /external and /random
+@router.get("/api/proxies/{level}")
+async def get_proxies_by_level(level: str, response: Response, page_size: int = None, cursor: str = None, fields: str = None, current_user: dict = Depends(get_current_user_obj)):
+    if level not in ["gold", "silver", "bronze"]:
+        raise HTTPException(status_code=400, detail="Invalid level")
+    
+    limit, fields, after = page_request(current_user, page_size, cursor, fields)
+    email = current_user["email"]
+    is_admin = current_user["is_admin"]
+        
+    page = await db.get_proxies(level, limit=limit, user_email=email, is_admin=is_admin, fields=fields, after=after)
+    # The body stays a plain list; the next page is announced in a header
+    if page["next_cursor"]:
+        response.headers["X-Next-Cursor"] = page["next_cursor"]
+    return page["items"]
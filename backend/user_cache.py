@@ -0,0 +1,91 @@
+import os
+import time
+from collections import OrderedDict
+
+# Users resolved by email or API key, so an authenticated request does not
+# cost a users query. Per process: writes through AsyncPostgresClient
+# invalidate here, other processes see them after USER_CACHE_TTL at most.
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000")) # entries (one per email / per API key)
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60")) # seconds
+
+class UserCache:
+    """LRU of ("email", email) / ("api_key", key hash) -> (expires_at, user row) with a TTL"""
+
+    def __init__(self, size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        # email -> API key hashes cached for that user, for invalidate()
+        self.key_owners = {}
+        self.counters = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0, "invalidated": 0}
+
+    def _get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.counters["misses"] += 1
+            return None
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            self._drop(key)
+            self.counters["expired"] += 1
+            self.counters["misses"] += 1
+            return None
+        self.entries.move_to_end(key)
+        self.counters["hits"] += 1
+        return dict(user)
+
+    def _put(self, key, user):
+        self.entries[key] = (time.monotonic() + self.ttl, dict(user))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self._drop(next(iter(self.entries)))
+            self.counters["evicted"] += 1
+
+    def _drop(self, key):
+        """Remove one entry, keeping key_owners in step"""
+        entry = self.entries.pop(key, None)
+        if entry is not None and key[0] == "api_key":
+            email = entry[1]["email"]
+            digests = self.key_owners.get(email)
+            if digests is not None:
+                digests.discard(key[1])
+                if not digests:
+                    del self.key_owners[email]
+        return entry
+
+    def get_by_email(self, email: str):
+        return self._get(("email", email))
+
+    def get_by_key_hash(self, key_hash: str):
+        return self._get(("api_key", key_hash))
+
+    def put(self, user, key_hash: str = None):
+        """Cache `user` under its email, and under `key_hash` (api_keys.hash_api_key) when looked up by key"""
+        self._put(("email", user["email"]), user)
+        if key_hash:
+            self._put(("api_key", key_hash), user)
+            self.key_owners.setdefault(user["email"], set()).add(key_hash)
+
+    def invalidate(self, email: str):
+        """Drop every entry for `email` after its row changed"""
+        keys = [("email", email)] + [("api_key", digest) for digest in list(self.key_owners.get(email, ()))]
+        for key in keys:
+            if self._drop(key) is not None:
+                self.counters["invalidated"] += 1
+        self.key_owners.pop(email, None)
+
+    def clear(self):
+        self.entries.clear()
+        self.key_owners.clear()
+
+    def stats(self):
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            "size": len(self.entries),
+            "max_size": self.size,
+            "ttl_seconds": self.ttl,
+            **self.counters,
+            "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else 0.0,
+        }
+
+user_cache = UserCache()
@@ -0,0 +1,87 @@
+"""
+Checks/sec of the single-process checker (check_all) against the sharded
+one (check_sharded), using local fake proxies so the network is not the
+bottleneck. Nothing is written to the database; results are only counted.
+
+The fake proxy answers 200 to any request after --delay-ms. Importing the
+checker runs its init_db, so DATABASE_URL should point at a reachable
+(scratch) database.
+
+    python benchmarks/bench_checker_shards.py --proxies 20000 --processes 1 2 4
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+
+from aiohttp import web
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(BASE_DIR, "worker"))
+
+import checker
+
+def serve_fake_proxy(port, delay):
+    async def handler(request):
+        if delay:
+            await asyncio.sleep(delay)
+        return web.Response(text="ok")
+
+    async def main():
+        server = web.Server(handler)
+        runner = web.ServerRunner(server, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port, reuse_port=True, backlog=4096).start()
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+async def timed_run(proxies, processes, concurrency):
+    count = 0
+
+    async def sink(result):
+        nonlocal count
+        count += 1
+
+    start = time.perf_counter()
+    if processes > 1:
+        await checker.check_sharded(proxies, sink, processes, concurrency)
+    else:
+        await checker.check_all(proxies, sink, concurrency)
+    return count, time.perf_counter() - start
+
+def run(args):
+    servers = [
+        multiprocessing.Process(target=serve_fake_proxy, args=(args.port, args.delay_ms / 1000), daemon=True)
+        for _ in range(args.server_procs)
+    ]
+    for server in servers:
+        server.start()
+    time.sleep(1)
+
+    checker.raise_fd_limit(args.concurrency * max(args.processes) * 2 + 256)
+    proxies = [f"127.0.0.1:{args.port}"] * args.proxies
+
+    print(f"{args.proxies} checks, concurrency {args.concurrency}/process, fake latency {args.delay_ms}ms, mode {checker.CHECK_MODE}")
+    for processes in args.processes:
+        for key in checker.check_stats:
+            checker.check_stats[key] = 0
+        count, elapsed = asyncio.run(timed_run(proxies, processes, args.concurrency))
+        print(f"{processes:>2} process(es): {count} results in {elapsed:6.2f}s  {count / elapsed:9.1f} checks/sec  {checker.check_stats}")
+
+    for server in servers:
+        server.terminate()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--proxies", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=checker.CHECK_CONCURRENCY)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--delay-ms", type=int, default=50)
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--server-procs", type=int, default=4)
+    args = parser.parse_args()
+    run(args)
@@ -41,11 +41,11 @@ def check_db():
             print("WARNING: No proxies found in the database!")
 
         # Check Users
-        cur.execute("SELECT email, api_key FROM users;")
+        cur.execute("SELECT email, api_key_prefix FROM users;")
         users = cur.fetchall()
         print("\n--- Users ---")
         for u in users:
-            print(f"Email: {u[0]}, API Key: {u[1]}")
+            print(f"Email: {u[0]}, API Key: {u[1] + '…' if u[1] else None}")
 
         cur.close()
         conn.close()
@@ -75,18 +75,20 @@ def run_diagnostics():
 
     added = 0
     for p in mock_proxies:
-        proxy_str = f"{p['ip']}:{p['port']}:{p['country']}:{p['code']}"
+        proxy_str = f"{p['ip']}:{p['port']}"
         try:
             cursor.execute("""
-                INSERT INTO proxies (proxy, ip, port, country, country_code, latency, level, last_checked, lat, lon)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP, %s, %s)
-                ON CONFLICT (proxy) DO UPDATE SET
+                INSERT INTO proxies (ip, port, country, country_code, latency, level, last_checked, lat, lon)
+                VALUES (%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP, %s, %s)
+                ON CONFLICT (ip, port) DO UPDATE SET
+                    country = EXCLUDED.country,
+                    country_code = EXCLUDED.country_code,
                     latency = EXCLUDED.latency,
                     level = EXCLUDED.level,
                     last_checked = CURRENT_TIMESTAMP,
                     lat = EXCLUDED.lat,
                     lon = EXCLUDED.lon
-            """, (proxy_str, p['ip'], p['port'], p['country'], p['code'], p['latency'], p['level'], p['lat'], p['lon']))
+            """, (p['ip'], int(p['port']), p['country'], p['code'], p['latency'], p['level'], p['lat'], p['lon']))
             added += 1
         except Exception as e:
             print(f"   Error inserting {proxy_str}: {e}")
@@ -0,0 +1,43 @@
+import logging
+import time
+
+# Event-driven proxy allocation. Read endpoints no longer assign; users are
+# topped up when their quota changes (login, limit upgrade: backend/router.py)
+# and here, after each check run (new supply) and retention pass (deaths).
+
+last_allocation_report = {}
+
+def run_allocator(conn):
+    """
+    Recount users.assigned_count, then top up every user below quota on
+    `conn` (psycopg2) and mirror the new assignments into the hot pool.
+    Returns and logs a report.
+    """
+    global last_allocation_report
+    from backend.database import RECONCILE_ASSIGNED_COUNTS_SQL, USERS_BELOW_QUOTA_SQL, top_up
+    from backend.hot_pool import publish_assigned
+    start = time.perf_counter()
+
+    cursor = conn.cursor()
+    cursor.execute(RECONCILE_ASSIGNED_COUNTS_SQL)
+    reconciled = cursor.rowcount
+    cursor.execute(USERS_BELOW_QUOTA_SQL)
+    emails = [row[0] for row in cursor.fetchall()]
+    conn.commit()
+
+    assigned = 0
+    for email in emails:
+        rows = top_up(conn, email)
+        publish_assigned(email, rows)
+        assigned += len(rows)
+
+    last_allocation_report = {
+        "reconciled": reconciled,
+        "below_quota": len(emails),
+        "assigned": assigned,
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+    msg = f"Allocator: {last_allocation_report}"
+    logging.info(msg)
+    print(msg)
+    return last_allocation_report
@@ -0,0 +1,83 @@
+import hashlib
+import math
+import os
+import time
+
+# Negative cache for proxies that just failed a check. proxy_state backoff
+# keeps dead proxies out of normal planning; this only covers the scheduler's
+# fallback (planning failed, so a random sample of the scrape is checked),
+# where public lists would otherwise feed back the same dead addresses every
+# tick. 0 TTL disables the cache. Defaults to the first-failure backoff
+# (recheck.DEAD_BACKOFF_BASE).
+DEAD_CACHE_TTL = int(os.getenv("DEAD_CACHE_TTL", os.getenv("DEAD_BACKOFF_BASE", "300"))) # seconds
+DEAD_CACHE_CAPACITY = int(os.getenv("DEAD_CACHE_CAPACITY", "200000")) # entries per generation
+DEAD_CACHE_FP_RATE = float(os.getenv("DEAD_CACHE_FP_RATE", "0.01"))
+
+class DeadProxyFilter:
+    """
+    Rotating Bloom filter: two generations of TTL/2 each. New entries go into
+    the current one, lookups check both, and rotating drops the older, so an
+    entry is remembered for between TTL/2 and TTL seconds in a few hundred KB.
+    A false positive only postpones one live proxy to a later tick.
+    """
+
+    def __init__(self, ttl=DEAD_CACHE_TTL, capacity=DEAD_CACHE_CAPACITY, fp_rate=DEAD_CACHE_FP_RATE):
+        self.ttl = ttl
+        self.bits = max(8, int(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.current = bytearray((self.bits + 7) // 8)
+        self.previous = bytearray(len(self.current))
+        self.rotated_at = time.monotonic()
+        self.stats = {"hits": 0, "misses": 0, "added": 0}
+
+    def _positions(self, proxy):
+        digest = hashlib.blake2b(proxy.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def _rotate(self):
+        now = time.monotonic()
+        age = now - self.rotated_at
+        if age < self.ttl / 2:
+            return
+        if age >= self.ttl:
+            # Idle for a whole TTL: both generations have expired
+            self.previous = bytearray(len(self.current))
+        else:
+            self.previous = self.current
+        self.current = bytearray(len(self.previous))
+        self.rotated_at = now
+
+    def add(self, proxy):
+        if not self.ttl:
+            return
+        self._rotate()
+        for pos in self._positions(proxy):
+            self.current[pos >> 3] |= 1 << (pos & 7)
+        self.stats["added"] += 1
+
+    def __contains__(self, proxy):
+        if not self.ttl:
+            return False
+        self._rotate()
+        positions = self._positions(proxy)
+        for generation in (self.current, self.previous):
+            if all(generation[pos >> 3] & (1 << (pos & 7)) for pos in positions):
+                return True
+        return False
+
+    def filter(self, proxies, keep=()):
+        """Drop recently dead proxies from `proxies`, counting hits/misses. Proxies in `keep` always pass."""
+        alive = []
+        hits = 0
+        for proxy in proxies:
+            if proxy not in keep and proxy in self:
+                hits += 1
+            else:
+                alive.append(proxy)
+        self.stats["hits"] += hits
+        self.stats["misses"] += len(alive)
+        return alive
+
+dead_cache = DeadProxyFilter()
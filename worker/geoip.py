@@ -0,0 +1,124 @@
+import logging
+import os
+from collections import OrderedDict
+
+from psycopg2.extras import execute_values
+
+try:
+    import maxminddb
+except ImportError:  # optional, falls back to ip-api through the proxy
+    maxminddb = None
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# MaxMind-format database (GeoLite2-City / GeoLite2-Country or compatible), memory-mapped
+GEOIP_DB_PATH = os.getenv("GEOIP_DB_PATH", os.path.join(BASE_DIR, "data", "GeoLite2-City.mmdb"))
+GEOIP_CACHE_SIZE = int(os.getenv("GEOIP_CACHE_SIZE", "100000")) # resolved IPs kept in memory
+# Ask ip-api through the proxy when the local database has no answer
+GEOIP_REMOTE = os.getenv("GEOIP_REMOTE", "1") == "1"
+# ip-api answers are kept in the geoip_cache table this long
+GEOIP_CACHE_TTL_DAYS = float(os.getenv("GEOIP_CACHE_TTL_DAYS", "30"))
+
+LOAD_CACHED_SQL = '''
+    SELECT ip, country, country_code, lat, lon FROM geoip_cache
+    WHERE ip = ANY(%s) AND resolved_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 day'
+'''
+STORE_CACHED_SQL = '''
+    INSERT INTO geoip_cache (ip, country, country_code, lat, lon, resolved_at) VALUES %s
+    ON CONFLICT (ip) DO UPDATE SET
+        country = EXCLUDED.country,
+        country_code = EXCLUDED.country_code,
+        lat = EXCLUDED.lat,
+        lon = EXCLUDED.lon,
+        resolved_at = EXCLUDED.resolved_at
+'''
+STORE_TEMPLATE = "(%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)"
+
+geo_stats = {"cache_hits": 0, "local": 0, "remote": 0, "unresolved": 0, "preloaded": 0}
+
+class GeoCache:
+    """LRU of ip -> (country, country_code, lat, lon) for IPs already resolved"""
+
+    def __init__(self, size=GEOIP_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, ip):
+        entry = self.entries.get(ip)
+        if entry is not None:
+            self.entries.move_to_end(ip)
+        return entry
+
+    def put(self, ip, entry):
+        self.entries[ip] = entry
+        self.entries.move_to_end(ip)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+geo_cache = GeoCache()
+
+# ip-api answers from this process not yet written to geoip_cache
+pending_store = {}
+
+def remember_remote(ip, entry):
+    geo_cache.put(ip, entry)
+    pending_store[ip] = entry
+
+def preload(conn, ips):
+    """One query for every IP about to be checked; hits go into the LRU"""
+    missing = [ip for ip in set(ips) if geo_cache.get(ip) is None]
+    if not missing:
+        return 0
+    cursor = conn.cursor()
+    cursor.execute(LOAD_CACHED_SQL, (missing, GEOIP_CACHE_TTL_DAYS))
+    rows = cursor.fetchall()
+    conn.commit()
+    for ip, country, country_code, lat, lon in rows:
+        geo_cache.put(ip, (country, country_code, lat, lon))
+    geo_stats["preloaded"] += len(rows)
+    return len(rows)
+
+def store_pending(conn):
+    """Bulk-write this process's new ip-api answers to geoip_cache"""
+    if not pending_store:
+        return 0
+    rows = [(ip,) + entry for ip, entry in pending_store.items()]
+    cursor = conn.cursor()
+    execute_values(cursor, STORE_CACHED_SQL, rows, template=STORE_TEMPLATE, page_size=1000)
+    conn.commit()
+    pending_store.clear()
+    return len(rows)
+
+_reader = None
+_reader_failed = False
+
+def get_reader():
+    """Open the local database once; None if the module or file is missing"""
+    global _reader, _reader_failed
+    if _reader is None and not _reader_failed:
+        if maxminddb is None or not os.path.exists(GEOIP_DB_PATH):
+            _reader_failed = True
+            logging.info(f"GeoIP database not available ({GEOIP_DB_PATH}), using ip-api only")
+        else:
+            try:
+                _reader = maxminddb.open_database(GEOIP_DB_PATH, maxminddb.MODE_MMAP)
+            except Exception as e:
+                _reader_failed = True
+                logging.warning(f"Could not open GeoIP database {GEOIP_DB_PATH}: {e}")
+    return _reader
+
+def lookup_local(ip):
+    """Resolve `ip` from the local database. Returns (country, country_code, lat, lon) or None."""
+    reader = get_reader()
+    if reader is None:
+        return None
+    try:
+        record = reader.get(ip)
+    except ValueError: # not an IP address
+        return None
+    if not record or "country" not in record:
+        return None
+    country = record["country"].get("names", {}).get("en", "Unknown")
+    country_code = record["country"].get("iso_code", "UN")
+    location = record.get("location", {})
+    return country, country_code, location.get("latitude"), location.get("longitude")
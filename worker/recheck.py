@@ -0,0 +1,100 @@
+import logging
+import os
+
+from psycopg2.extras import execute_values
+
+# Per-proxy recheck scheduling. proxy_state (backend/migrations.py) holds one
+# row per scraped ip:port with when it is next due, how many checks in a row
+# it has failed and its last latency. Each tick checks at most CHECK_BUDGET
+# due proxies, best candidates first.
+
+CHECK_BUDGET = int(os.getenv("CHECK_BUDGET", "3000")) # checks per scheduler tick
+# Seconds until a live proxy is due again, by tier: fast ones are rechecked most often
+RECHECK_INTERVALS = {
+    "gold": int(os.getenv("RECHECK_GOLD", "120")),
+    "silver": int(os.getenv("RECHECK_SILVER", "300")),
+    "bronze": int(os.getenv("RECHECK_BRONZE", "900")),
+}
+# Dead proxies wait DEAD_BACKOFF_BASE * 2^(failures - 1) seconds, up to DEAD_BACKOFF_MAX
+DEAD_BACKOFF_BASE = int(os.getenv("DEAD_BACKOFF_BASE", "300"))
+DEAD_BACKOFF_MAX = int(os.getenv("DEAD_BACKOFF_MAX", "86400"))
+
+# New proxies are due right away; known ones keep their schedule and only
+# get last_seen bumped (worker/retention.py forgets ones no source lists).
+# last_seen only needs hour resolution against the STATE_WINDOW_HOURS expiry,
+# so rows seen within the hour are not rewritten on every tick.
+REGISTER_PROXIES_SQL = '''
+    INSERT INTO proxy_state (proxy) VALUES %s
+    ON CONFLICT (proxy) DO UPDATE SET last_seen = CURRENT_TIMESTAMP
+    WHERE proxy_state.last_seen < CURRENT_TIMESTAMP - INTERVAL '1 hour'
+'''
+
+# Known-good first (fastest first), then never-checked, then dead ones by
+# shortest streak; oldest due date breaks ties.
+SELECT_DUE_SQL = '''
+    SELECT proxy FROM proxy_state
+    WHERE next_check_at <= CURRENT_TIMESTAMP
+    ORDER BY failure_streak ASC, last_latency ASC NULLS LAST, next_check_at ASC
+    LIMIT %s
+'''
+
+# Due now, and dead ones the backoff is holding back (the checks it saves this tick)
+COUNT_DUE_SQL = '''
+    SELECT COUNT(*) FILTER (WHERE next_check_at <= CURRENT_TIMESTAMP),
+           COUNT(*) FILTER (WHERE failure_streak > 0 AND next_check_at > CURRENT_TIMESTAMP)
+    FROM proxy_state
+'''
+
+# Rows are (proxy, failed 0/1, latency, level, seconds until due). For a dead
+# proxy that is DEAD_BACKOFF_BASE on first failure; repeat failures double it
+# from the stored streak.
+RECORD_RESULTS_SQL = f'''
+    INSERT INTO proxy_state AS s (proxy, failure_streak, last_latency, last_level, last_checked, next_check_at)
+    VALUES %s
+    ON CONFLICT (proxy) DO UPDATE SET
+        failure_streak = CASE WHEN EXCLUDED.failure_streak = 0 THEN 0 ELSE s.failure_streak + 1 END,
+        last_latency = COALESCE(EXCLUDED.last_latency, s.last_latency),
+        last_level = EXCLUDED.last_level,
+        last_checked = EXCLUDED.last_checked,
+        next_check_at = CASE
+            WHEN EXCLUDED.failure_streak = 0 THEN EXCLUDED.next_check_at
+            ELSE CURRENT_TIMESTAMP + LEAST({DEAD_BACKOFF_BASE} * 2 ^ LEAST(s.failure_streak, 30), {DEAD_BACKOFF_MAX}) * INTERVAL '1 second'
+        END
+'''
+RECORD_TEMPLATE = "(%s, %s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')"
+
+def state_row(proxy, level, latency):
+    """proxy_state row for one check: `level` is None when the proxy is dead or out of range"""
+    if level is None:
+        return (proxy, 1, None, None, min(DEAD_BACKOFF_BASE, DEAD_BACKOFF_MAX))
+    return (proxy, 0, latency, level, RECHECK_INTERVALS[level])
+
+def record_results(conn, rows):
+    """Bulk-apply state_row() rows on `conn` and commit. The last row wins for duplicates."""
+    unique = {row[0]: row for row in rows}
+    if not unique:
+        return
+    cursor = conn.cursor()
+    execute_values(cursor, RECORD_RESULTS_SQL, list(unique.values()), template=RECORD_TEMPLATE, page_size=1000)
+    conn.commit()
+
+def plan_checks(conn, proxies, budget=CHECK_BUDGET):
+    """
+    Register freshly scraped `proxies` and return up to `budget` due proxies
+    in priority order. Proxies known from earlier scrapes stay scheduled even
+    when a source stops listing them, until retention expires them.
+    """
+    cursor = conn.cursor()
+    execute_values(cursor, REGISTER_PROXIES_SQL, [(proxy,) for proxy in set(proxies)], page_size=1000)
+    conn.commit()
+
+    cursor.execute(COUNT_DUE_SQL)
+    due, backed_off = cursor.fetchone()
+    cursor.execute(SELECT_DUE_SQL, (budget,))
+    selected = [row[0] for row in cursor.fetchall()]
+    conn.commit()
+
+    msg = f"Recheck plan: {len(selected)} of {due} due proxies (budget {budget}, {backed_off} dead ones held back by backoff)"
+    logging.info(msg)
+    print(msg)
+    return selected
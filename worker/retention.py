@@ -0,0 +1,144 @@
+import logging
+import os
+import time
+
+from backend.migrations import PROXY_ENDPOINT
+from checker import refresh_stats
+from geoip import GEOIP_CACHE_TTL_DAYS
+
+# Retention: drop proxies that keep failing or have not passed a check for a
+# while, forget proxy_state rows no source has listed for a while and expired
+# geoip_cache entries. Deletes
+# run in small committed batches so the API never waits on one long lock.
+RETENTION_MAX_FAILURES = int(os.getenv("RETENTION_MAX_FAILURES", "3")) # failed rechecks in a row = dead
+RETENTION_WINDOW_HOURS = float(os.getenv("RETENTION_WINDOW_HOURS", "24")) # no successful check for this long = stale
+STATE_WINDOW_HOURS = float(os.getenv("STATE_WINDOW_HOURS", "72")) # not scraped for this long = forgotten
+RETENTION_BATCH = int(os.getenv("RETENTION_BATCH", "1000")) # rows per DELETE
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", "10")) # minutes between runs
+
+# Deleting the row also releases its assigned_to slot
+# proxy_state is keyed on the scraped "ip:port" text; idx_proxies_endpoint serves the join
+DELETE_DEAD_SQL = f'''
+    DELETE FROM proxies WHERE (ip, port) IN (
+        SELECT p.ip, p.port FROM proxies p
+        JOIN proxy_state s ON s.proxy = {PROXY_ENDPOINT}
+        WHERE s.failure_streak >= %s
+        LIMIT %s
+    )
+    RETURNING host(ip) || ':' || port, assigned_to
+'''
+
+DELETE_STALE_SQL = '''
+    DELETE FROM proxies WHERE (ip, port) IN (
+        SELECT ip, port FROM proxies
+        WHERE last_checked < CURRENT_TIMESTAMP - %s * INTERVAL '1 hour'
+        LIMIT %s
+    )
+    RETURNING host(ip) || ':' || port, assigned_to
+'''
+
+DELETE_FORGOTTEN_STATE_SQL = '''
+    DELETE FROM proxy_state WHERE proxy IN (
+        SELECT proxy FROM proxy_state
+        WHERE last_seen < CURRENT_TIMESTAMP - %s * INTERVAL '1 hour'
+        LIMIT %s
+    )
+    RETURNING proxy, NULL AS assigned_to
+'''
+
+DELETE_EXPIRED_GEOIP_SQL = '''
+    DELETE FROM geoip_cache WHERE ip IN (
+        SELECT ip FROM geoip_cache
+        WHERE resolved_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 day'
+        LIMIT %s
+    )
+    RETURNING ip, NULL AS assigned_to
+'''
+
+TABLE_SIZE_SQL = "SELECT pg_total_relation_size('proxies'), pg_total_relation_size('proxy_state')"
+
+# Last run, for logs and anyone polling the worker
+last_retention_report = {}
+
+def delete_in_batches(conn, sql, params, on_batch=None):
+    """
+    Run a DELETE ... LIMIT batch until it comes back short, calling
+    on_batch(rows) after each commit. Returns (deleted, rows that had an owner).
+    """
+    cursor = conn.cursor()
+    deleted = 0
+    released = 0
+    while True:
+        cursor.execute(sql, params + (RETENTION_BATCH,))
+        rows = cursor.fetchall()
+        conn.commit()
+        deleted += len(rows)
+        released += sum(1 for _, assigned_to in rows if assigned_to)
+        if rows and on_batch:
+            on_batch(rows)
+        if len(rows) < RETENTION_BATCH:
+            return deleted, released
+
+def measure(conn):
+    """
+    Row count, on-disk sizes and the server-side time of a full-table read.
+    The read runs under EXPLAIN ANALYZE, so no rows are sent to the worker.
+    """
+    from backend.database import ALL_ROWS_SQL, TOTAL_COUNT_SQL
+    cursor = conn.cursor()
+    cursor.execute(TABLE_SIZE_SQL)
+    proxies_bytes, state_bytes = cursor.fetchone()
+
+    start = time.perf_counter()
+    cursor.execute(TOTAL_COUNT_SQL)
+    rows = cursor.fetchone()[0]
+    count_ms = (time.perf_counter() - start) * 1000
+
+    cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + ALL_ROWS_SQL)
+    all_rows_ms = cursor.fetchone()[0][0]["Execution Time"]
+    conn.commit()
+
+    return {
+        "rows": rows,
+        "proxies_kb": proxies_bytes // 1024,
+        "proxy_state_kb": state_bytes // 1024,
+        "count_ms": round(count_ms, 1),
+        "all_rows_ms": round(all_rows_ms, 1),
+    }
+
+def run_retention(conn):
+    """One retention pass on `conn` (psycopg2). Returns and logs a before/after report."""
+    global last_retention_report
+    from backend.hot_pool import remove_batch
+    before = measure(conn)
+    start = time.perf_counter()
+
+    dead, dead_released = delete_in_batches(conn, DELETE_DEAD_SQL, (RETENTION_MAX_FAILURES,), remove_batch)
+    stale, stale_released = delete_in_batches(conn, DELETE_STALE_SQL, (RETENTION_WINDOW_HOURS,), remove_batch)
+    forgotten, _ = delete_in_batches(conn, DELETE_FORGOTTEN_STATE_SQL, (STATE_WINDOW_HOURS,))
+    geoip_expired, _ = delete_in_batches(conn, DELETE_EXPIRED_GEOIP_SQL, (GEOIP_CACHE_TTL_DAYS,))
+
+    elapsed = time.perf_counter() - start
+    if dead or stale:
+        refresh_stats(conn)
+    after = measure(conn)
+    last_retention_report = {
+        "dead": dead,
+        "stale": stale,
+        "released": dead_released + stale_released,
+        "forgotten_state": forgotten,
+        "geoip_expired": geoip_expired,
+        "seconds": round(elapsed, 2),
+        "before": before,
+        "after": after,
+    }
+
+    msg = (
+        f"Retention: removed {dead} dead and {stale} stale proxies "
+        f"({dead_released + stale_released} assignments released), forgot {forgotten} state rows and {geoip_expired} GeoIP entries in {elapsed:.2f}s. "
+        f"proxies {before['rows']} -> {after['rows']} rows, {before['proxies_kb']} -> {after['proxies_kb']} KB, "
+        f"COUNT {before['count_ms']} -> {after['count_ms']} ms, SELECT * {before['all_rows_ms']} -> {after['all_rows_ms']} ms"
+    )
+    logging.info(msg)
+    print(msg)
+    return last_retention_report
@@ -1,14 +1,23 @@
+import os
+import sys
+
+# Add parent dir to path to import backend (checker needs it at import time)
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
 from apscheduler.schedulers.blocking import BlockingScheduler
 from sources import get_proxies
-from checker import run_checker
+from checker import run_checker, get_db_connection, FALLBACK_SET
+from dead_cache import dead_cache
+from recheck import plan_checks, CHECK_BUDGET
+from retention import run_retention, RETENTION_INTERVAL
+from allocator import run_allocator
 import time
+import random
 import logging
-import os
-import sys
 from datetime import datetime
 
 # Setup logging
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 LOG_FILE = os.path.join(BASE_DIR, "worker.log")
 
 logging.basicConfig(
@@ -17,9 +26,6 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-# Add parent dir to path to import backend
-sys.path.append(BASE_DIR)
-
 def job():
     logging.info("Starting proxy check job...")
     print("Starting proxy check job...")
@@ -33,12 +39,38 @@ def job():
         if not proxies:
             print("⚠️ No proxies fetched! Check network connection or sources.")
         
-        # 2. Check & Save to DB
+        # 2. Pick what to check this tick: due proxies, best candidates first
+        try:
+            conn = get_db_connection()
+            try:
+                proxies = plan_checks(conn, proxies)
+            finally:
+                conn.close()
+        except Exception as e:
+            logging.error(f"Recheck planning failed, checking a random sample: {e}")
+            print(f"Recheck planning failed, checking a random sample: {e}")
+            # No proxy_state backoff to lean on: skip the ones that just failed
+            proxies = dead_cache.filter(proxies, keep=FALLBACK_SET)
+            random.shuffle(proxies)
+            proxies = proxies[:CHECK_BUDGET]
+        
+        # 3. Check & Save to DB
         run_checker(proxies)
         
-        # 3. Save History Snapshot
+        # 4. Top up users below quota from the freshly checked supply
+        try:
+            conn = get_db_connection()
+            try:
+                run_allocator(conn)
+            finally:
+                conn.close()
+        except Exception as e:
+            logging.error(f"Allocation failed: {e}")
+            print(f"Allocation failed: {e}")
+        
+        # 5. Save History Snapshot
         try:
-            from backend.database import redis_client as db_client
+            from backend.database import db_client
             stats = db_client.get_stats()
             timestamp = datetime.now().strftime("%H:%M:%S")
             
@@ -60,10 +92,25 @@ def job():
         logging.error(f"Job failed: {e}")
         print(f"Job failed: {e}")
 
+def retention_job():
+    try:
+        conn = get_db_connection()
+        try:
+            run_retention(conn)
+            # Deleted proxies may have been assigned; refill those users now
+            run_allocator(conn)
+        finally:
+            conn.close()
+    except Exception as e:
+        logging.error(f"Retention failed: {e}")
+        print(f"Retention failed: {e}")
+
 if __name__ == "__main__":
     scheduler = BlockingScheduler()
     # Run every 1 minute
     scheduler.add_job(job, 'interval', minutes=1)
+    # Expire dead / stale proxies in the background
+    scheduler.add_job(retention_job, 'interval', minutes=RETENTION_INTERVAL)
     
     print("Worker started. Press Ctrl+C to exit.")
     
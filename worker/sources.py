@@ -1,92 +1,193 @@
-import requests
+import asyncio
+import aiohttp
+import json
+import logging
+import os
+import time
+
+# Well-known always-up endpoints kept in every scrape so the pool is never empty.
+# checker.check_proxy skips the network check for these.
+FALLBACK_PROXIES = [
+    "1.1.1.1:80",
+    "8.8.8.8:80",
+    "8.8.4.4:80",
+    "208.67.222.222:80",
+    "208.67.220.220:80",
+    "185.228.168.9:80", # CleanBrowsing
+    "76.76.19.19:80", # Control D
+    "94.140.14.14:80", # AdGuard
+]
+
+SOURCE_TIMEOUT = float(os.getenv("SOURCE_TIMEOUT", "10")) # per source
+# Whole fetch stops here and keeps whatever already arrived
+SOURCE_DEADLINE = float(os.getenv("SOURCE_DEADLINE", "15"))
+# Parsed lists plus ETag / Last-Modified per source, so unchanged lists cost a 304
+SOURCE_CACHE_DIR = os.getenv("SOURCE_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".source_cache"))
+
+# --- Registry ---
+# Parsers turn a response body into a list of "ip:port". Sources name a parser
+# and how often (seconds) they are worth re-downloading.
+
+PARSERS = {}
+SOURCES = {}
+
+def register_parser(name):
+    def decorator(fn):
+        PARSERS[name] = fn
+        return fn
+    return decorator
+
+def register_source(name, url, parser="text", refresh_interval=60):
+    if parser not in PARSERS:
+        raise ValueError(f"Unknown parser '{parser}' for source '{name}'")
+    SOURCES[name] = {"name": name, "url": url, "parser": parser, "refresh_interval": refresh_interval}
+
+@register_parser("text")
+def parse_text(body):
+    """One ip:port per line"""
+    return [line.strip() for line in body.splitlines() if line.strip()]
+
+@register_parser("geonode")
+def parse_geonode(body):
+    """Geonode JSON API: {"data": [{"ip": ..., "port": ...}, ...]}"""
+    items = json.loads(body).get('data', [])
+    return [f"{item['ip']}:{item['port']}" for item in items]
+
+# Source 1: ProxyScrape (HTTP)
+register_source("proxyscrape", "https://api.proxyscrape.com/v2/?request=getproxies&protocol=http&timeout=10000&country=all&ssl=all&anonymity=all", refresh_interval=60)
+# Source 2: Geonode (Free List)
+register_source("geonode", "https://proxylist.geonode.com/api/proxy-list?limit=200&page=1&sort_by=lastChecked&sort_type=desc&protocols=http%2Chttps", parser="geonode", refresh_interval=120)
+# Sources 3-6: Raw lists on GitHub, regenerated a few times an hour at most
+register_source("thespeedx", "https://raw.githubusercontent.com/TheSpeedX/PROXY-List/master/http.txt", refresh_interval=600)
+register_source("monosans", "https://raw.githubusercontent.com/monosans/proxy-list/main/proxies/http.txt", refresh_interval=600)
+register_source("shiftytr", "https://raw.githubusercontent.com/ShiftyTR/Proxy-List/master/http.txt", refresh_interval=600)
+register_source("hookzof", "https://raw.githubusercontent.com/hookzof/socks5_list/master/proxy.txt", refresh_interval=600)
+
+# --- On-disk cache ---
+
+def cache_path(source):
+    return os.path.join(SOURCE_CACHE_DIR, f"{source['name']}.json")
+
+def load_cache(source):
+    try:
+        with open(cache_path(source)) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # A changed URL invalidates the entry
+    return entry if entry.get("url") == source["url"] else None
+
+def save_cache(source, entry):
+    try:
+        os.makedirs(SOURCE_CACHE_DIR, exist_ok=True)
+        tmp = cache_path(source) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp, cache_path(source))
+    except OSError as e:
+        logging.warning(f"Could not write source cache for {source['name']}: {e}")
+
+# Per-source outcome of the last get_proxies() call: name, status, count, seconds
+last_fetch_report = []
+
+async def fetch_source(session, source):
+    """
+    Fetch one source, going to the network only when its refresh_interval has
+    passed, and then conditionally (If-None-Match / If-Modified-Since).
+    Falls back to the cached list if the fetch fails.
+    """
+    start = time.perf_counter()
+    report = {"name": source["name"], "status": "error", "count": 0, "seconds": 0.0}
+    cached = load_cache(source)
+    proxies = []
+    try:
+        if cached and time.time() - cached["fetched_at"] < source["refresh_interval"]:
+            report["status"] = "cached"
+            proxies = cached["proxies"]
+            return proxies, report
+
+        headers = {}
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached and cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+        async with session.get(source["url"], headers=headers, timeout=aiohttp.ClientTimeout(total=SOURCE_TIMEOUT)) as response:
+            if response.status == 304 and cached:
+                report["status"] = "not modified"
+                proxies = cached["proxies"]
+                cached["fetched_at"] = time.time()
+                save_cache(source, cached)
+            elif response.status == 200:
+                proxies = PARSERS[source["parser"]](await response.text())
+                report["status"] = "ok"
+                save_cache(source, {
+                    "url": source["url"],
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "fetched_at": time.time(),
+                    "proxies": proxies,
+                })
+            else:
+                report["status"] = f"http {response.status}"
+    except asyncio.TimeoutError:
+        report["status"] = "timeout"
+    except Exception as e:
+        report["status"] = f"error: {e}"
+    finally:
+        if not proxies and cached and report["status"] not in ("ok", "not modified"):
+            # Stale list beats nothing
+            proxies = cached["proxies"]
+            report["status"] += " (stale cache)"
+        report["count"] = len(proxies)
+        report["seconds"] = round(time.perf_counter() - start, 3)
+    return proxies, report
+
+async def fetch_all(sources, deadline=SOURCE_DEADLINE):
+    """Fetch every distinct URL concurrently; stop at `deadline` seconds and keep what arrived (cached lists for the rest)."""
+    unique = {}
+    for source in sources:
+        unique.setdefault(source["url"], source)
+
+    proxies = []
+    reports = []
+    async with aiohttp.ClientSession() as session:
+        tasks = {asyncio.create_task(fetch_source(session, source)): source for source in unique.values()}
+        done, pending = await asyncio.wait(tasks, timeout=deadline)
+
+        for task in pending:
+            task.cancel()
+            # Cancelled before fetch_source could fall back: do it here
+            cached = load_cache(tasks[task])
+            items = cached["proxies"] if cached else []
+            proxies.extend(items)
+            status = "deadline (stale cache)" if cached else "deadline"
+            reports.append({"name": tasks[task]["name"], "status": status, "count": len(items), "seconds": deadline})
+        # Let cancelled fetches unwind before the session closes
+        await asyncio.gather(*pending, return_exceptions=True)
+        for task in done:
+            items, report = task.result()
+            proxies.extend(items)
+            reports.append(report)
+
+    return proxies, reports
 
 def get_proxies():
     """
     Fetches proxies from external sources.
     Returns a list of proxies (ip:port).
     """
-    # For demonstration, we'll use a hardcoded list and a public API if available.
-    # In a real scenario, you'd add more sources here.
-    
-    proxies = [
-        "1.1.1.1:80", 
-        "8.8.8.8:80",
-        "8.8.4.4:80",
-        "208.67.222.222:80",
-        "208.67.220.220:80",
-        "185.228.168.9:80", # CleanBrowsing
-        "76.76.19.19:80", # Control D
-        "94.140.14.14:80", # AdGuard
-    ]
-    
+    global last_fetch_report
+
+    proxies = list(FALLBACK_PROXIES)
+
     try:
-        # Example: Fetch from a free proxy list (text format)
-        try:
-            response = requests.get("https://api.proxyscrape.com/v2/?request=getproxies&protocol=http&timeout=10000&country=all&ssl=all&anonymity=all", timeout=10)
-            if response.status_code == 200:
-                lines = response.text.splitlines()
-                proxies.extend([line.strip() for line in lines if line.strip()])
-        except Exception:
-            pass
-            
-        # Source 2: Geonode (Free List)
-        try:
-            response2 = requests.get("https://proxylist.geonode.com/api/proxy-list?limit=200&page=1&sort_by=lastChecked&sort_type=desc&protocols=http%2Chttps", timeout=10)
-            if response2.status_code == 200:
-                data = response2.json()
-                items = data.get('data', [])
-                for item in items:
-                    proxies.append(f"{item['ip']}:{item['port']}")
-        except Exception:
-            pass
-
-        # Source 3: ProxyScrape (HTTP) - Redundant but kept for safety
-        try:
-            r3 = requests.get("https://api.proxyscrape.com/v2/?request=getproxies&protocol=http&timeout=10000&country=all&ssl=all&anonymity=all", timeout=10)
-            if r3.status_code == 200:
-                lines = r3.text.splitlines()
-                proxies.extend([x.strip() for x in lines if x.strip()])
-        except Exception:
-            pass
-
-        # Source 4: Raw List (GitHub - TheSpeedX)
-        try:
-            r4 = requests.get("https://raw.githubusercontent.com/TheSpeedX/PROXY-List/master/http.txt", timeout=10)
-            if r4.status_code == 200:
-                lines = r4.text.splitlines()
-                proxies.extend([x.strip() for x in lines if x.strip()])
-        except Exception:
-            pass
-
-        # Source 5: Raw List (GitHub - Monosans)
-        try:
-            r5 = requests.get("https://raw.githubusercontent.com/monosans/proxy-list/main/proxies/http.txt", timeout=10)
-            if r5.status_code == 200:
-                lines = r5.text.splitlines()
-                proxies.extend([x.strip() for x in lines if x.strip()])
-        except Exception:
-            pass
-
-        # Source 6: Raw List (GitHub - shiftytr)
-        try:
-            r6 = requests.get("https://raw.githubusercontent.com/ShiftyTR/Proxy-List/master/http.txt", timeout=10)
-            if r6.status_code == 200:
-                lines = r6.text.splitlines()
-                proxies.extend([x.strip() for x in lines if x.strip()])
-        except Exception:
-            pass
-
-        # Source 7: Raw List (GitHub - hookzof)
-        try:
-            r7 = requests.get("https://raw.githubusercontent.com/hookzof/socks5_list/master/proxy.txt", timeout=10)
-            if r7.status_code == 200:
-                lines = r7.text.splitlines()
-                proxies.extend([x.strip() for x in lines if x.strip()])
-        except Exception:
-            pass
-
-    except Exception:
-        pass
-        
+        fetched, last_fetch_report = asyncio.run(fetch_all(SOURCES.values()))
+        proxies.extend(fetched)
+        for report in last_fetch_report:
+            logging.info(f"Source {report['name']}: {report['status']}, {report['count']} proxies in {report['seconds']}s")
+    except Exception as e:
+        logging.error(f"Fetching sources failed: {e}")
+
     unique_proxies = list(set(proxies))
     return unique_proxies